@@ -0,0 +1,104 @@
+"""
+Benchmarks the parsing of a saved corpus of vlr.gg pages.
+
+Every ``*.html`` file in the corpus directory is parsed into a full BeautifulSoup tree, as the
+scraper used to, and by the targeted ``parse_*`` function the scraper uses for that kind of page.
+The mean parse time and peak memory per page are printed and appended to a csv file so the cost
+of parsing can be tracked over time.
+
+Usage: python benchmark_parsing.py CORPUS [--output parse_benchmarks.csv] [--repeat 3]
+"""
+import argparse
+import csv
+import datetime
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+from pathlib import Path
+
+from vct.get_data import PARSER, parse_match, parse_match_list, parse_tournament
+
+
+def parse_function(html: str):
+    """Finds the function the scraper uses to parse a page."""
+    if "vm-stats-game" in html:
+        return parse_match
+    elif "match-item" in html:
+        return parse_match_list
+    elif "wf-table" in html:
+        return parse_tournament
+    return None
+
+
+def full_tree(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "html.parser")
+
+
+def measure(function, pages: list[str], repeat: int) -> tuple[float, float]:
+    """
+    Mean time in milliseconds and mean peak memory in KiB to parse each page. Timings use the
+    fastest of ``repeat`` runs and memory is traced in a separate run.
+    """
+
+    times, peaks = [], []
+    for html in pages:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(html)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best * 1000)
+
+        tracemalloc.start()
+        function(html)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+
+    return sum(times) / len(times), sum(peaks) / len(peaks)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark parsing of saved vlr.gg pages.")
+    parser.add_argument("corpus", type=Path, help="Directory of saved html pages.")
+    parser.add_argument("--output", type=Path, default=Path("parse_benchmarks.csv"),
+                        help="csv file the results are appended to.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing runs for each page.")
+    args = parser.parse_args()
+
+    pages = {}
+    for path in sorted(args.corpus.glob("*.html")):
+        html = path.read_text(encoding="utf-8")
+        function = parse_function(html)
+        if function is not None:
+            pages.setdefault(function, []).append(html)
+
+    if not pages:
+        print(f"No vlr.gg pages found in {args.corpus}")
+        return
+
+    date = datetime.datetime.now().isoformat(timespec="seconds")
+    rows = []
+    print(f"Targeted parser: {PARSER}")
+    print(f"{'page':<18}{'pages':>6}{'full ms':>10}{'ms':>10}{'full KiB':>11}{'KiB':>10}"
+          f"{'speed up':>10}")
+    for function, htmls in pages.items():
+        full_time, full_peak = measure(full_tree, htmls, args.repeat)
+        parse_time, parse_peak = measure(function, htmls, args.repeat)
+        print(f"{function.__name__:<18}{len(htmls):>6}{full_time:>10.1f}{parse_time:>10.1f}"
+              f"{full_peak:>11.0f}{parse_peak:>10.0f}{full_time / parse_time:>9.1f}x")
+        rows.append([date, PARSER, function.__name__, len(htmls), round(full_time, 2),
+                     round(parse_time, 2), round(full_peak), round(parse_peak)])
+
+    new = not args.output.exists()
+    with open(args.output, "a", newline="") as file:
+        writer = csv.writer(file)
+        if new:
+            writer.writerow(["date", "parser", "page", "pages", "full_ms", "ms", "full_kib",
+                             "kib"])
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Re-parses every archived match page with the current parser.
+
+The matches of each archived page are replaced by the matches read from it, using a pool of worker
+processes, and the Map, Agent, Comp, Team and MatchAgent tables are regenerated from the matches.
+Pages that fail to parse keep their current matches.
+
+Usage: python reparse.py [DATABASE] [--method sql] [--processes N]
+"""
+import argparse
+import multiprocessing
+
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from vct.functions import upgrade_database
+from vct.get_data import VLRScrape
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-parse archived vlr.gg match pages.")
+    parser.add_argument("database", type=Path, nargs="?",
+                        default=Path(__file__).parents[1] / "VCT.db", help="The database file.")
+    parser.add_argument("--method", choices=["sql", "arrays", "parallel"], default="sql",
+                        help="How the tables are regenerated.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes, defaults to the number of CPUs.")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.database}")
+    upgrade_database(engine)
+    session = sessionmaker(bind=engine)()
+    VLRScrape(session, processes=args.processes).reparse(args.method)
+    session.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -1,3 +1,4 @@
+import multiprocessing
 import customtkinter as ctk
 
 from pathlib import Path
@@ -7,17 +8,20 @@ from sqlalchemy.orm import sessionmaker
 from vct.gui_elements import tkinterApp
 from vct.functions import create_database
 
-ctk.set_appearance_mode("system")
-ctk.set_default_color_theme("dark-blue")
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
 
-database: str = "VCT"
+    ctk.set_appearance_mode("system")
+    ctk.set_default_color_theme("dark-blue")
 
-path = fr"sqlite:///{str(Path(__file__).parents[1])}/{database}.db"
-engine = create_engine(path)
-Session = sessionmaker(bind=engine)
-session = Session()
-create_database(database, session)
+    database: str = "VCT"
 
-app = tkinterApp(engine)
-app.attributes("-fullscreen", "True")
-app.mainloop()
+    path = fr"sqlite:///{str(Path(__file__).parents[1])}/{database}.db"
+    engine = create_engine(path)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    create_database(database, session)
+
+    app = tkinterApp(engine)
+    app.attributes("-fullscreen", "True")
+    app.mainloop()
@@ -1,7 +1,12 @@
+import multiprocessing
+
 from pathlib import Path
 
 from vct import game_loop
 
-dir = fr"{str(Path(__file__).parents[1])}\VCT"
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    dir = fr"{str(Path(__file__).parents[1])}\VCT"
 
-game_loop(dir)
+    game_loop(dir)
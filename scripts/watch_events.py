@@ -0,0 +1,48 @@
+"""
+Keeps running tournaments up to date.
+
+Events added with ``--add`` are watched until every one of their matches is completed. Each
+watched event's matches page is polled more often while matches are being played, and completed
+matches are added to the database as soon as they are found. Stop the watcher with Ctrl-C.
+
+Usage: python watch_events.py [DATABASE] [--add URL ...] [--remove URL ...]
+"""
+import argparse
+import multiprocessing
+
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from vct.functions import upgrade_database
+from vct.watcher import EventWatcher
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Watch vlr.gg events for completed matches.")
+    parser.add_argument("database", type=Path, nargs="?",
+                        default=Path(__file__).parents[1] / "VCT.db", help="The database file.")
+    parser.add_argument("--add", nargs="+", default=[], metavar="URL",
+                        help="vlr.gg event urls to start watching.")
+    parser.add_argument("--remove", nargs="+", default=[], metavar="URL",
+                        help="vlr.gg event urls to stop watching.")
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.database}")
+    upgrade_database(engine)
+    session = sessionmaker(bind=engine)()
+    watcher = EventWatcher(session)
+    for url in args.add:
+        watcher.watch(url)
+    for url in args.remove:
+        watcher.unwatch(url)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    session.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from vct.databases import Agent, Comp, Map, Match, MatchAgent, Team, Tournament
+from vct.functions import upgrade_database
+from vct.rebuild import rebuild
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "VCT.db")
+TOURNAMENTS = 3
+
+
+def snapshot(session: Session, played: bool = False) -> dict[str, set[tuple]]:
+    """
+    Reads every row of the aggregate tables through the ORM, so names are compared in either keys
+    mode. With ``played`` only the map, agent and team rows with games are read, as stored in the
+    sparse mode.
+    """
+
+    tables = {}
+    for table in [Tournament, Map, Agent, Team, Comp, MatchAgent]:
+        columns = [column for column in table.__table__.columns if column.name != "id"]
+        query = select(*columns)
+        if played and table in [Map, Agent, Team]:
+            query = query.where(table.games > 0)
+        tables[table.__tablename__] = set(session.execute(query).tuples())
+    return tables
+
+
+def dump(path: str) -> dict[str, list[tuple]]:
+    """Reads every row of every table as it is stored, with the columns in order of name."""
+    tables = {}
+    with sqlite3.connect(path) as connection:
+        for table, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            columns = sorted([row[1] for row in connection.execute(f"PRAGMA table_info({table})")])
+            tables[table] = sorted(connection.execute(
+                f"SELECT {', '.join(columns)} FROM {table}"), key=repr)
+    return tables
+
+
+def match_rows(session: Session, count: int) -> list[dict]:
+    """Removes the last matches from the database, returning their columns."""
+    matches = session.scalars(select(Match).order_by(Match.id.desc()).limit(count)).all()
+    rows = [dict([(column.name, getattr(match, column.name)) for column in Match.__table__.columns
+                  if column.name not in ["id", "team_1_mask", "team_2_mask"]])
+            for match in reversed(matches)]
+    for match in matches:
+        session.delete(match)
+    session.flush()
+    rebuild(session)
+    session.commit()
+    return rows
+
+
+@pytest.fixture(scope="session")
+def trimmed(tmp_path_factory) -> str:
+    """A copy of the bundled database keeping the matches of its smallest tournaments."""
+    path = str(tmp_path_factory.mktemp("database") / "VCT.db")
+    shutil.copy(DATABASE, path)
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "DELETE FROM matches WHERE tournament NOT IN (SELECT tournament FROM matches "
+            "GROUP BY tournament ORDER BY count(*), tournament LIMIT ?)", (TOURNAMENTS,))
+    engine = create_engine(f"sqlite:///{path}")
+    upgrade_database(engine)
+    with Session(engine) as session:
+        rebuild(session)
+    engine.dispose()
+    return path
+
+
+@pytest.fixture
+def path(trimmed, tmp_path) -> str:
+    path = str(tmp_path / "VCT.db")
+    shutil.copy(trimmed, path)
+    return path
+
+
+@pytest.fixture
+def session(path) -> Session:
+    engine = create_engine(f"sqlite:///{path}")
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
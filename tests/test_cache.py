@@ -0,0 +1,102 @@
+import datetime
+import json
+
+import pytest
+import requests
+
+from vct.cache import CacheMiss, ResponseCache, page_class
+from vct.get_data import VLRScrape
+from vct.limiter import RateLimiter
+
+COMPLETED = '<div class="match-header-vs-note">final</div>'
+UPCOMING = '<div class="match-header-vs-note">upcoming</div>'
+
+
+def age(cache, url, delta):
+    """Moves back when a cached page was fetched."""
+    path = cache._index_path(url)
+    with open(path) as file:
+        entry = json.load(file)
+    fetched = datetime.datetime.fromisoformat(entry["fetched"]) - delta
+    entry["fetched"] = fetched.isoformat()
+    with open(path, "w") as file:
+        json.dump(entry, file)
+
+
+def test_page_class():
+    assert page_class("https://www.vlr.gg/event/matches/1/x") == "event"
+    assert page_class("https://www.vlr.gg/event/agents/1/x") == "agents"
+    assert page_class("https://www.vlr.gg/1/x", COMPLETED) == "completed"
+    assert page_class("https://www.vlr.gg/1/x", UPCOMING) == "match"
+    assert page_class("https://www.vlr.gg/team/1/x") == "other"
+
+
+def test_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get("https://www.vlr.gg/1/x") is None
+    cache.put("https://www.vlr.gg/1/x", COMPLETED)
+    cache.put("https://www.vlr.gg/2/x", UPCOMING)
+    age(cache, "https://www.vlr.gg/1/x", datetime.timedelta(days=365))
+    age(cache, "https://www.vlr.gg/2/x", datetime.timedelta(minutes=5))
+    assert cache.get("https://www.vlr.gg/1/x") == COMPLETED
+    assert cache.get("https://www.vlr.gg/2/x") == UPCOMING
+
+    age(cache, "https://www.vlr.gg/2/x", datetime.timedelta(minutes=10))
+    assert cache.get("https://www.vlr.gg/2/x") is None
+    assert ResponseCache(str(tmp_path), {"match": None}).get("https://www.vlr.gg/2/x") == UPCOMING
+
+
+def test_offline(tmp_path):
+    ResponseCache(str(tmp_path)).put("https://www.vlr.gg/event/matches/1/x", "matches")
+    cache = ResponseCache(str(tmp_path), offline=True)
+    age(cache, "https://www.vlr.gg/event/matches/1/x", datetime.timedelta(days=30))
+    assert cache.get("https://www.vlr.gg/event/matches/1/x") == "matches"
+    with pytest.raises(CacheMiss):
+        cache.get("https://www.vlr.gg/event/matches/2/x")
+
+
+def test_shared_pages(tmp_path):
+    """A page with the same content for two urls is stored once."""
+    cache = ResponseCache(str(tmp_path))
+    cache.put("https://www.vlr.gg/1/x", COMPLETED)
+    cache.put("https://www.vlr.gg/2/x", COMPLETED)
+    assert len(list((tmp_path / "pages").rglob("*"))) == 2
+    assert len(list((tmp_path / "index").iterdir())) == 2
+
+
+class Response:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+
+def test_conditional_requests(tmp_path, monkeypatch):
+    url = "https://www.vlr.gg/event/matches/1/x"
+    cache = ResponseCache(str(tmp_path), {"event": datetime.timedelta(0)})
+    scraper = VLRScrape(None, limiter=RateLimiter(0.001), cache=cache)
+    sent = []
+    responses = [Response(200, "matches", {"ETag": '"a"', "Last-Modified": "Mon"}),
+                 Response(304), Response(500, "error page")]
+
+    def get(url, headers):
+        sent.append(headers)
+        return responses.pop(0)
+
+    monkeypatch.setattr(requests, "get", get)
+    assert scraper.fetch(url) == "matches"
+    assert "If-None-Match" not in sent[0]
+    assert cache.validators(url) == {"If-None-Match": '"a"', "If-Modified-Since": "Mon"}
+
+    age(cache, url, datetime.timedelta(minutes=1))
+    assert scraper.fetch(url) == "matches"
+    assert sent[1]["If-None-Match"] == '"a"'
+    assert sent[1]["If-Modified-Since"] == "Mon"
+
+    with pytest.raises(requests.HTTPError):
+        scraper.fetch(url)
+    assert ResponseCache(str(tmp_path), offline=True).get(url) == "matches"
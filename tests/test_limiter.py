@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+from vct.limiter import RateLimiter
+
+
+def test_spacing():
+    limiter = RateLimiter(0.05)
+    start = time.monotonic()
+    times = []
+    for _ in range(4):
+        limiter.wait()
+        times.append(time.monotonic() - start)
+    assert times[0] < 0.04
+    for before, after in zip(times, times[1:]):
+        assert after - before >= 0.045
+
+
+def test_reserve_order():
+    """Each request reserves its token when it starts waiting, so queued requests keep order."""
+    limiter = RateLimiter(10)
+    delays = [limiter.reserve() for _ in range(3)]
+    assert delays[0] == 0
+    assert delays[1] == pytest.approx(10, abs=0.1)
+    assert delays[2] == pytest.approx(20, abs=0.1)
+    assert limiter.delay() == pytest.approx(30, abs=0.1)
+
+
+def test_burst():
+    limiter = RateLimiter(10, burst=2)
+    assert [limiter.reserve() for _ in range(2)] == [0, 0]
+    assert limiter.reserve() == pytest.approx(10, abs=0.1)
+
+
+def test_wait_async():
+    limiter = RateLimiter(0.05)
+
+    async def requests():
+        start = time.monotonic()
+        await asyncio.gather(*[limiter.wait_async() for _ in range(3)])
+        return time.monotonic() - start
+
+    assert asyncio.run(requests()) >= 0.095
+
+
+@pytest.mark.parametrize("interval", [0, -1])
+def test_interval(interval):
+    with pytest.raises(ValueError):
+        RateLimiter(interval)
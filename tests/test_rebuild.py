@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import select, update
+
+from conftest import match_rows, snapshot
+from vct import data_refresh
+from vct.databases import Agent, Match, Tournament
+from vct.new_game import Ingest, new_game
+from vct.rebuild import rebuild, refresh_tournament
+
+
+def test_replay(session):
+    """The set-based rebuild gives the same tables as adding every match through Ingest."""
+    rebuild(session)
+    session.commit()
+    expected = snapshot(session)
+    data_refresh(session, "replay")
+    assert snapshot(session) == expected
+
+
+@pytest.mark.parametrize("method", ["arrays", "parallel"])
+def test_methods(session, method):
+    rebuild(session)
+    session.commit()
+    expected = snapshot(session)
+    rebuild(session, method, processes=2)
+    session.commit()
+    assert snapshot(session) == expected
+
+
+def test_unknown_method(session):
+    with pytest.raises(ValueError):
+        rebuild(session, "loop")
+
+
+def test_ingest_batch(session):
+    """Adding matches in one Ingest batch matches adding them one at a time with new_game."""
+    rows = match_rows(session, 6)
+    with Ingest(session) as ingest:
+        for row in rows:
+            match = Match(**row)
+            session.add(match)
+            ingest.add(match)
+    batched = snapshot(session)
+
+    for match in session.scalars(select(Match).order_by(Match.id.desc()).limit(6)):
+        session.delete(match)
+    session.commit()
+    rebuild(session)
+    session.commit()
+    for row in rows:
+        match = Match(**row)
+        session.add(match)
+        new_game(match, int(match.team_1_score > match.team_2_score), session)
+    assert snapshot(session) == batched
+
+    rebuild(session)
+    session.commit()
+    assert snapshot(session) == batched
+
+
+def test_refresh_tournament(session):
+    """Refreshing a tournament whose matches changed gives the same tables as a full rebuild."""
+    tournament = session.scalar(select(Match.tournament).group_by(Match.tournament))
+    session.execute(update(Agent).where(Agent.tournament == tournament, Agent.map == "Overall")
+                    .values(games=Agent.games + 7))
+    matches = session.scalars(select(Match).where(Match.tournament == tournament).limit(3)).all()
+    session.delete(matches[0])
+    session.delete(matches[1])
+    matches[2].team_1_score, matches[2].team_2_score = (matches[2].team_2_score,
+                                                        matches[2].team_1_score)
+    session.commit()
+
+    refresh_tournament(tournament, session)
+    refreshed = snapshot(session)
+    rebuild(session)
+    session.commit()
+    assert snapshot(session) == refreshed
+    assert session.get(Tournament, tournament).games == session.query(Match).where(
+        Match.tournament == tournament).count()
+
+    with pytest.raises(ValueError):
+        refresh_tournament("Overall", session)
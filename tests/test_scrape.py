@@ -0,0 +1,236 @@
+import datetime
+import json
+
+import pytest
+import requests
+from sqlalchemy import select, update
+
+from conftest import match_rows, snapshot
+from vct.databases import Match, ScrapeJob
+from vct.get_data import BACKFILL, LIVE, MANUAL, RECENT, VLRScrape
+from vct.limiter import RateLimiter
+from vct.new_game import Ingest
+from vct.rebuild import rebuild
+
+BASE = "https://www.vlr.gg"
+
+
+class FakeScrape(VLRScrape):
+    """Scraper reading records made from matches instead of requesting and parsing pages."""
+
+    def __init__(self, session, records, **kwargs):
+        super().__init__(session, limiter=RateLimiter(0.001), processes=1, **kwargs)
+        self.records = records
+        self.fetched = []
+        self.parsed = []
+        self.parse_errors = set()
+        self.fetch_errors = set()
+
+    async def _fetch(self, url):
+        self.fetched.append(url)
+        if url in self.fetch_errors:
+            raise requests.ConnectionError(f"Could not connect: {url}")
+        return url
+
+    async def _parse(self, parse, html):
+        self.parsed.append(html)
+        if html in self.parse_errors:
+            raise ValueError(f"Could not parse: {html}")
+        return self.records[html]
+
+
+@pytest.fixture
+def records(session, tmp_path, monkeypatch):
+    """A record for each of the last six series, removed from the database to be scraped again."""
+    monkeypatch.chdir(tmp_path)
+    rows = match_rows(session, 12)
+    records = {}
+    for start in range(0, len(rows), 2):
+        maps = []
+        for row in rows[start:start + 2]:
+            row = dict(row)
+            tournament = row.pop("tournament")
+            row.pop("code")
+            maps.append(dict(map=row["map"], teams=[row["team_1"], row["team_2"]],
+                             agents=[row[f"team_{side}_agent_{slot}"]
+                                     for side in [1, 2] for slot in range(1, 6)],
+                             match=row))
+        records[f"{BASE}/{900 + start}/series"] = dict(
+            completed=True, tournament=tournament, tournament_link="/event/1/x", maps=maps)
+    return records
+
+
+def job(session, url):
+    return session.execute(select(ScrapeJob).where(ScrapeJob.url == url)).scalar_one()
+
+
+def assert_consistent(session):
+    """The aggregate tables match a full rebuild from the stored matches."""
+    scraped = snapshot(session)
+    rebuild(session)
+    session.commit()
+    assert snapshot(session) == scraped
+
+
+@pytest.mark.parametrize("batch_size", [1, 4])
+def test_scrape(session, records, batch_size):
+    scraper = FakeScrape(session, records, batch_size=batch_size)
+    scraper.add_matches(list(records))
+    scraper.find_match_data()
+
+    assert scraper.match_urls == []
+    for url in records:
+        assert (job(session, url).state, job(session, url).attempts) == ("stored", 1)
+    assert session.query(Match).where(Match.code.in_(["900", "910"])).count() == 4
+    assert_consistent(session)
+
+    scraper = FakeScrape(session, records)
+    scraper.add_matches(list(records))
+    scraper.find_match_data()
+    assert scraper.fetched == []
+
+
+def test_parse_failure(session, records):
+    failing = f"{BASE}/902/series"
+    for attempt in range(1, FakeScrape.max_attempts + 2):
+        scraper = FakeScrape(session, records)
+        scraper.parse_errors.add(failing)
+        if attempt == 1:
+            scraper.add_matches(list(records))
+        scraper.find_match_data()
+        failed = job(session, failing)
+        session.refresh(failed)
+        assert failed.state == "failed"
+        assert failed.attempts == min(attempt, FakeScrape.max_attempts)
+        assert failed.error == f"ValueError: Could not parse: {failing}"
+        assert (failing in scraper.fetched) == (attempt == 1)
+        assert (failing in scraper.parsed) == (attempt <= FakeScrape.max_attempts)
+
+    scraper = FakeScrape(session, records)
+    scraper.add_matches([failing])
+    scraper.find_match_data()
+    stored = job(session, failing)
+    session.refresh(stored)
+    assert (stored.state, stored.attempts, stored.error) == ("stored", 1, None)
+    assert_consistent(session)
+
+
+def test_fetch_failure(session, records):
+    failing = f"{BASE}/904/series"
+    scraper = FakeScrape(session, records)
+    scraper.fetch_errors.add(failing)
+    scraper.add_matches(list(records))
+    scraper.find_match_data()
+    failed = job(session, failing)
+    assert (failed.state, failed.attempts, failed.html) == ("failed", 1, None)
+    assert failing in scraper.match_urls
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_store_failure(session, records, batch_size, monkeypatch):
+    """
+    A match which fails to store is rolled back alone, keeping the rest of its batch and the
+    state of every other job.
+    """
+
+    parse_failing = f"{BASE}/902/series"
+    store_failing = f"{BASE}/904/series"
+    second_map = records[store_failing]["maps"][1]["match"]
+    prepare = Ingest._prepare
+
+    def failing_prepare(self, match, result=None):
+        if match.code == "904" and match.map == second_map["map"]:
+            raise RuntimeError("Could not store")
+        return prepare(self, match, result)
+
+    monkeypatch.setattr(Ingest, "_prepare", failing_prepare)
+    scraper = FakeScrape(session, records, batch_size=batch_size)
+    scraper.parse_errors.add(parse_failing)
+    scraper.add_matches(list(records))
+    scraper.find_match_data()
+
+    parse_failed = job(session, parse_failing)
+    assert (parse_failed.state, parse_failed.attempts) == ("failed", 1)
+    assert parse_failed.error == f"ValueError: Could not parse: {parse_failing}"
+    store_failed = job(session, store_failing)
+    assert (store_failed.state, store_failed.attempts) == ("failed", 1)
+    assert store_failed.error == "RuntimeError: Could not store"
+    assert store_failed.html == store_failing
+    for url in set(records) - {parse_failing, store_failing}:
+        assert job(session, url).state == "stored"
+    assert session.query(Match).where(Match.code == "904").count() == 0
+    assert session.query(Match).where(Match.code.in_(["900", "906", "908", "910"])).count() == 8
+    assert_consistent(session)
+
+    monkeypatch.setattr(Ingest, "_prepare", prepare)
+    scraper = FakeScrape(session, records)
+    scraper.find_match_data()
+    stored = job(session, store_failing)
+    session.refresh(stored)
+    assert (stored.state, stored.attempts, stored.error) == ("stored", 2, None)
+    assert store_failing not in scraper.fetched
+    assert session.query(Match).where(Match.code == "904").count() == 2
+    assert_consistent(session)
+
+
+def test_resume(session, records):
+    """Jobs continue from the last state they reached."""
+    fetched, parsed = f"{BASE}/900/series", f"{BASE}/902/series"
+    scraper = FakeScrape(session, records)
+    scraper.add_jobs("match", list(records))
+    scraper._set_job(fetched, state="fetched", html=fetched)
+    scraper._set_job(parsed, state="parsed", html=parsed, record=json.dumps(records[parsed]))
+    session.commit()
+    scraper.parse_errors.add(parsed)
+    scraper.find_match_data()
+    assert fetched not in scraper.fetched and parsed not in scraper.fetched
+    assert job(session, parsed).state == "stored"
+    assert_consistent(session)
+
+
+def order(session, scraper):
+    """The order the jobs are started in, with every fetch failing."""
+    scraper.fetch_errors = set([url for url, in session.execute(select(ScrapeJob.url))])
+    scraper.find_match_data()
+    return [url.split("/")[3] for url in scraper.fetched]
+
+
+def test_priority(session, records):
+    scraper = FakeScrape(session, records)
+    scraper.backfill_share = 100
+    scraper.add_jobs("match", [f"{BASE}/{code}/x" for code in [1, 2, 3]], BACKFILL)
+    scraper.add_jobs("match", [f"{BASE}/4/x"], RECENT)
+    scraper.add_jobs("match", [f"{BASE}/5/x"], LIVE)
+    scraper.add_jobs("match", [f"{BASE}/3/x"], MANUAL)
+    old = datetime.datetime.now() - 3 * FakeScrape.aging
+    session.execute(update(ScrapeJob).where(ScrapeJob.url == f"{BASE}/2/x").values(created=old))
+    session.commit()
+    assert session.scalar(select(scraper._urgency()).where(
+        ScrapeJob.url == f"{BASE}/2/x")) == BACKFILL - 1
+    assert order(session, scraper) == ["5", "3", "4", "2", "1"]
+
+    scraper = FakeScrape(session, records)
+    scraper.max_attempts = 5
+    scraper.find_match_data(MANUAL)
+    assert [url.split("/")[3] for url in scraper.fetched] == ["5", "3"]
+
+
+def test_backfill_share(session, records):
+    """A steady supply of urgent jobs still leaves the backfill one job in every share."""
+    scraper = FakeScrape(session, records)
+    scraper.add_jobs("match", [f"{BASE}/{code}/backfill" for code in range(1, 4)], BACKFILL)
+    added = []
+
+    async def fetch(url):
+        scraper.fetched.append(url)
+        if len(added) < 12:
+            added.append(f"{BASE}/{100 + len(added)}/live")
+            scraper.add_jobs("match", added[-1:], LIVE)
+        raise requests.ConnectionError(url)
+
+    scraper.add_jobs("match", [f"{BASE}/99/live"], LIVE)
+    scraper._fetch = fetch
+    scraper.find_match_data()
+    kinds = [url.split("/")[4] for url in scraper.fetched]
+    share = FakeScrape.backfill_share
+    assert kinds[:3 * share] == (["live"] * (share - 1) + ["backfill"]) * 3
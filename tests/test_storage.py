@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from conftest import dump, match_rows, snapshot
+from vct.databases import Match
+from vct.functions import get_setting
+from vct.new_game import Ingest
+from vct.rebuild import rebuild, set_keys, set_rollups, set_storage, update_rollups
+
+
+def add_matches(session, rows):
+    with Ingest(session) as ingest:
+        for row in rows:
+            match = Match(**row)
+            session.add(match)
+            ingest.add(match)
+
+
+def test_sparse(session):
+    dense = snapshot(session)
+    played = snapshot(session, played=True)
+    assert played != dense
+    set_storage("sparse", session)
+    assert get_setting("storage", session) == "sparse"
+    assert snapshot(session) == played
+    set_storage("dense", session)
+    assert snapshot(session) == dense
+
+
+def test_sparse_ingest(session):
+    rows = match_rows(session, 6)
+    add_matches(session, rows)
+    played = snapshot(session, played=True)
+
+    match_rows(session, 6)
+    set_storage("sparse", session)
+    add_matches(session, rows)
+    assert snapshot(session) == played
+
+
+@pytest.mark.parametrize("storage", ["dense", "sparse"])
+def test_read_rollups(session, storage):
+    """Rollups recalculated on read equal the rollups updated as each match is added."""
+    set_storage(storage, session)
+    rows = match_rows(session, 6)
+    add_matches(session, rows)
+    stored = snapshot(session)
+
+    match_rows(session, 6)
+    set_rollups("read", session)
+    add_matches(session, rows)
+    assert get_setting("rollups_stale", session) == "1"
+    assert snapshot(session) != stored
+    update_rollups(session)
+    assert get_setting("rollups_stale", session) == "0"
+    assert snapshot(session) == stored
+
+    set_rollups("stored", session)
+    assert snapshot(session) == stored
+
+
+def test_ids(session, path):
+    names = snapshot(session)
+    stored = dump(path)
+    set_keys("ids", session)
+    assert snapshot(session) == names
+    with sqlite3.connect(path) as connection:
+        assert connection.execute(
+            "SELECT DISTINCT typeof(team_1), typeof(map) FROM matches").fetchall() == [
+            ("integer", "integer")]
+
+    set_keys("names", session)
+    assert snapshot(session) == names
+    restored = dump(path)
+    assert restored.pop("settings") != stored.pop("settings")
+    assert restored == stored
+
+
+def test_ids_ingest(session):
+    rows = match_rows(session, 6)
+    add_matches(session, rows)
+    names = snapshot(session)
+
+    match_rows(session, 6)
+    set_keys("ids", session)
+    add_matches(session, rows)
+    assert snapshot(session) == names
+    rebuild(session)
+    session.commit()
+    assert snapshot(session) == names
+
+
+def test_unknown_modes(session):
+    for switch in [set_storage, set_rollups, set_keys]:
+        with pytest.raises(ValueError):
+            switch("unknown", session)
@@ -0,0 +1,148 @@
+import datetime
+import threading
+
+import pytest
+import requests
+
+from conftest import match_rows, snapshot
+from vct.cache import ResponseCache
+from vct.databases import Match, WatchedEvent
+from vct.get_data import VLRScrape
+from vct.limiter import RateLimiter
+from vct.rebuild import rebuild
+from vct.watcher import EventWatcher, poll_interval
+
+EVENT = "https://www.vlr.gg/event/1/x"
+LIVE = datetime.timedelta(minutes=5)
+IDLE = datetime.timedelta(hours=6)
+
+
+def match_page(tournament, rows):
+    """A match page with the parts of vlr.gg's layout that are read."""
+    tab = "\t"
+    maps = ""
+    for game, row in enumerate(rows):
+        agents = "".join([f'<span class="mod-agent"><img title="'
+                          f'{row[f"team_{side}_agent_{slot}"].title()}"></span>'
+                          for side in [1, 2] for slot in range(1, 6)])
+        maps += (
+            f'<div class="vm-stats-game" data-game-id="{game}"><div class="team">'
+            f'<div class="score">{row["team_1_score"]}</div>'
+            f'<div class="team-name">{tab * 7}{row["team_1"]}{tab}</div>'
+            f'<span class="mod-ct">{row["team_1_half"]}</span>'
+            f'<span class="mod-t">{row["team_1_half_2"]}</span></div>'
+            f'<div class="map">{tab * 7}{row["map"].title()}{tab}</div><div class="team">'
+            f'<div class="team-name">{tab * 7}{row["team_2"]}{tab}</div>'
+            f'<span class="mod-t">{row["team_2_half"]}</span>'
+            f'<span class="mod-ct">{row["team_2_half_2"]}</span>'
+            f'<div class="score">{row["team_2_score"]}</div></div><table>{agents}</table></div>')
+    return (f'<html><body><a class="match-header-event" href="/event/1/x">{tab * 6}{tournament}'
+            f'{tab}</a><div class="match-header-vs-note">final</div>'
+            f'<div class="vm-stats-game" data-game-id="all"></div>{maps}</body></html>')
+
+
+def matches_page(statuses):
+    return "".join([f'<a class="match-item" href="/{code}/x">'
+                    '<div class="match-item-event-series">Playoffs</div>'
+                    f'<div class="ml-status">{status}</div><div class="ml-eta">{eta}</div></a>'
+                    for code, (status, eta) in statuses.items()])
+
+
+class Response:
+    def __init__(self, text):
+        self.status_code = 200
+        self.text = text
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def site(session, tmp_path, monkeypatch):
+    """Serves an event's matches page and the pages of its last three series."""
+    monkeypatch.chdir(tmp_path)
+    rows = match_rows(session, 6)
+    pages = dict([(f"https://www.vlr.gg/{900 + start}/x",
+                   match_page(rows[start]["tournament"], rows[start:start + 2]))
+                  for start in range(0, 6, 2)])
+    statuses = {900: ("Completed", ""), 902: ("LIVE", ""), 904: ("Upcoming", "1h 30m")}
+    requested = []
+
+    def get(url, headers):
+        requested.append(url)
+        if "/matches/" in url:
+            return Response(matches_page(statuses))
+        return Response(pages[url])
+
+    monkeypatch.setattr(requests, "get", get)
+    return statuses, requested
+
+
+@pytest.fixture
+def watcher(session, tmp_path):
+    scraper = VLRScrape(session, limiter=RateLimiter(0.001), processes=1, cache=ResponseCache(
+        str(tmp_path / "cache"), ttls={"event": datetime.timedelta(0)}))
+    watcher = EventWatcher(session, scraper)
+    watcher.watch(EVENT)
+    return watcher
+
+
+def test_poll(session, site, watcher):
+    statuses, requested = site
+    count = session.query(Match).count()
+
+    now = datetime.datetime.now()
+    next_poll = watcher.poll(EVENT)
+    assert now + LIVE <= next_poll <= datetime.datetime.now() + LIVE
+    assert session.query(Match).count() == count + 2
+    assert requested[-1] == "https://www.vlr.gg/900/x"
+
+    requested.clear()
+    watcher.poll(EVENT)
+    assert requested == [watcher.scraper.matches_url(EVENT)]
+
+    statuses[902] = ("Completed", "")
+    now = datetime.datetime.now()
+    next_poll = watcher.poll(EVENT)
+    assert now + datetime.timedelta(minutes=90) <= next_poll
+    assert session.query(Match).count() == count + 4
+
+    statuses[904] = ("Completed", "")
+    assert watcher.poll(EVENT) is None
+    assert session.get(WatchedEvent, EVENT).finished
+    assert session.query(Match).count() == count + 6
+
+    scraped = snapshot(session)
+    rebuild(session)
+    session.commit()
+    assert snapshot(session) == scraped
+
+
+def test_run(session, site, watcher):
+    statuses, _ = site
+    statuses[902] = statuses[904] = ("Completed", "")
+    count = session.query(Match).count()
+    watcher.run(threading.Event())
+    assert session.get(WatchedEvent, EVENT).finished
+    assert session.query(Match).count() == count + 6
+
+    stop = threading.Event()
+    stop.set()
+    watcher.watch(EVENT)
+    watcher.run(stop)
+    assert not session.get(WatchedEvent, EVENT).finished
+
+
+def test_poll_interval():
+    def match(status, eta=None, showmatch=False):
+        return dict(status=status, eta=eta, showmatch=showmatch)
+
+    assert poll_interval([], LIVE, IDLE) == IDLE
+    assert poll_interval([match("completed"), match("upcoming", showmatch=True)],
+                         LIVE, IDLE) is None
+    assert poll_interval([match("live"), match("upcoming", 60)], LIVE, IDLE) == LIVE
+    assert poll_interval([match("upcoming", 60)], LIVE, IDLE) == LIVE
+    assert poll_interval([match("upcoming", 3600)], LIVE, IDLE) == datetime.timedelta(hours=1)
+    assert poll_interval([match("upcoming", 10 ** 6)], LIVE, IDLE) == IDLE
+    assert poll_interval([match("upcoming")], LIVE, IDLE) == IDLE
@@ -3,14 +3,18 @@ import numpy as np
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import create_engine
 
-from .databases import Tournament, Map, Agent, Comp, Team, Match, Referall
-from .functions import data_check, choice_check, int_input, setup
-from .new_game import new_game
+from .databases import (Tournament, Map, Agent, Comp, Team, Match, MatchAgent, Referall,
+                        PendingReferall)
+from .functions import (data_check, choice_check, int_input, setup, upgrade_database,
+                        resolve_referalls)
+from .new_game import new_game, Ingest
 from .viewer import data_viewer
+from .cache import ResponseCache
 from .get_data import VLRScrape
+from .rebuild import rebuild, refresh_tournament, update_rollups
 
 
-def data_refresh(session: Session) -> None:
+def data_refresh(session: Session, method: str = "sql", processes: int = None) -> None:
     """
     Function to clear the current processed data and re-enter the data into databases. This is
     useful for if changes to how data is processed are made.
@@ -18,8 +22,19 @@ def data_refresh(session: Session) -> None:
     Parameters
     ----------
     session : Session
+    method : {"sql", "arrays", "parallel", "replay"}, default: "sql"
+        "replay" adds every match through :class:`~new_game.Ingest`, otherwise the tables are
+        regenerated in a single transaction by :func:`~rebuild.rebuild` using the given method.
+    processes : int, default: None
+        The number of worker processes for the "parallel" method, defaults to the number of CPUs.
     """
 
+    if method != "replay":
+        rebuild(session, method, processes)
+        return
+
+    session.query(MatchAgent).delete()
+
     maps = session.query(Map).all()
     for map in maps:
         session.delete(map)
@@ -50,12 +65,13 @@ def data_refresh(session: Session) -> None:
         setup(tournament, session)
 
     matches = session.query(Match).all()
-    for match in matches:
-        result = 0
-        if match.team_1_score > match.team_2_score:
-            result = 1
+    with Ingest(session) as ingest:
+        for match in matches:
+            result = 0
+            if match.team_1_score > match.team_2_score:
+                result = 1
 
-        new_game(match, result, session)
+            ingest.add(match, result)
 
 
 def new_tournament(session: Session) -> str:
@@ -284,8 +300,40 @@ def add_referall(type: str, session: Session) -> None:
     session.close()
 
 
-def vlr_scraper(session) -> None:
-    scraper = VLRScrape(session)
+def resolve_pending(session: Session) -> None:
+    """
+    Function to choose the abbreviations of the agents and teams added while scraping. Leaving an
+    abbreviation blank keeps the provisional one. All abbreviations are saved together.
+
+    Parameters
+    ----------
+    session : Session
+    """
+
+    pending = session.query(PendingReferall).all()
+    if not pending:
+        print("There are no new abbreviations to choose")
+        return
+
+    taken = set([referall.abbreviation for referall in session.query(Referall)])
+    abbreviations = {}
+    for referall in pending:
+        current = referall.referall_ref.abbreviation
+        while True:
+            short = input(f"Enter Abbreviation for {referall.name} ({current}): ").upper()
+            if not short:
+                short = current
+            if short == current or short not in taken:
+                break
+            print(f"{short} is already used")
+        taken.add(short)
+        abbreviations[referall.name] = short
+
+    resolve_referalls(abbreviations, session)
+
+
+def vlr_scraper(session, offline: bool = False) -> None:
+    scraper = VLRScrape(session, cache=ResponseCache(offline=True) if offline else None)
     while True:
         url = input("Enter the URL to be scraped")
         split_url = url.split("/")
@@ -321,6 +369,7 @@ def game_loop(database: str) -> None:
 
     while True:
         engine = create_engine(f"sqlite:///{database}.db")
+        upgrade_database(engine)
         Session = sessionmaker(bind=engine)
         session = Session()
 
@@ -333,10 +382,13 @@ def game_loop(database: str) -> None:
         if task == "a":  # add new data
             while True:
                 website = choice_check("Where do you want to scrape from?\n" +
-                                       "a) VLR.gg\n",
-                                       ["a"])
+                                       "a) VLR.gg\n" +
+                                       "b) Cached VLR.gg pages (offline)\n",
+                                       ["a", "b"])
                 if website == "a":
                     vlr_scraper(session)
+                elif website == "b":
+                    vlr_scraper(session, offline=True)
 
                 done = choice_check("Would you like to add something else? (y/n) ",
                                     ["y", "n"])
@@ -344,10 +396,27 @@ def game_loop(database: str) -> None:
                     break
 
         elif task == "b":  # view data
+            update_rollups(session)
             data_viewer(session)
 
         elif task == "c":  # update data
-            data_refresh(session)
+            refresh = choice_check("What do you want to refresh?\n" +
+                                   "a) All data\n" +
+                                   "b) A single tournament\n" +
+                                   "c) New abbreviations\n" +
+                                   "d) Re-parse archived match pages\n",
+                                   ["a", "b", "c", "d"])
+            if refresh == "a":
+                data_refresh(session)
+            elif refresh == "b":
+                tournaments = [tournament.tournament for tournament in session.query(
+                    Tournament).where(Tournament.tournament != "Overall")]
+                name = data_check("Enter the Tournament Name: ", tournaments, None)
+                refresh_tournament(name, session)
+            elif refresh == "c":
+                resolve_pending(session)
+            elif refresh == "d":
+                VLRScrape(session).reparse()
 
         session.close()
 
@@ -0,0 +1,262 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from .databases import Match
+
+AGENT_COLUMNS = [getattr(Match, f"team_{team}_agent_{n}") for team in (1, 2) for n in range(1, 6)]
+
+
+def encode(values: np.ndarray, overall: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts an array of names into integer codes.
+
+    Parameters
+    ----------
+    values : np.ndarray
+    overall : bool, default: False
+        If True "Overall" is added as the last name.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The sorted names and the code of each value.
+    """
+
+    names, codes = np.unique(values.astype(str), return_inverse=True)
+    names = names.astype(object)
+    if overall:
+        names = np.append(names, "Overall")
+    return names, codes.reshape(values.shape).astype(np.int16)
+
+
+class MatchArrays:
+    def __init__(self, session: Session, tournament: str = None):
+        """
+        Struct-of-arrays copy of the matches table, loaded with a single query. Tournaments, maps,
+        teams, agents and comps are stored as integer codes into the :attr:`tournaments`,
+        :attr:`maps`, :attr:`teams`, :attr:`agents` and :attr:`comps` arrays. The last entry of
+        :attr:`tournaments` and :attr:`maps` is "Overall".
+
+        Attributes
+        ----------
+        tournament, map : np.ndarray
+            Codes of shape (matches,).
+        team, comp : np.ndarray
+            Codes of shape (matches, 2), team 1 then team 2.
+        agent : np.ndarray
+            Codes of shape (matches, 2, 5).
+        score, half, half_2 : np.ndarray
+            Rounds won by each team of shape (matches, 2), in total, in the first half and in the
+            second half.
+        won : np.ndarray
+            Whether each team won of shape (matches, 2).
+
+        Parameters
+        ----------
+        session : Session
+        tournament : str, default: None
+            If given only the matches from this tournament are loaded.
+        """
+
+        query = select(
+            Match.tournament, Match.map, Match.team_1, Match.team_2,
+            Match.team_1_score, Match.team_2_score, Match.team_1_half, Match.team_2_half,
+            Match.team_1_half_2, Match.team_2_half_2, *AGENT_COLUMNS).order_by(Match.id)
+        if tournament is not None:
+            query = query.where(Match.tournament == tournament)
+        rows = session.execute(query).all()
+        data = np.array(rows, dtype=object).reshape(len(rows), 20)
+
+        self.tournaments, self.tournament = encode(data[:, 0], overall=True)
+        self.maps, self.map = encode(data[:, 1], overall=True)
+        self.teams, self.team = encode(data[:, 2:4])
+        self.score = data[:, 4:6].astype(np.int16)
+        self.half = data[:, 6:8].astype(np.int8)
+        self.half_2 = data[:, 8:10].astype(np.int8)
+        self.agents, self.agent = encode(data[:, 10:20])
+        self.agent = self.agent.reshape(len(rows), 2, 5)
+
+        self.won = np.zeros((len(rows), 2), dtype=bool)
+        self.won[:, 0] = self.score[:, 0] > self.score[:, 1]
+        self.won[:, 1] = ~self.won[:, 0]
+
+        comps, comp = np.unique(self.agent.reshape(-1, 5), axis=0, return_inverse=True)
+        self.comps = comps.reshape(-1, 5).astype(np.int16)
+        self.comp = comp.reshape(len(rows), 2).astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.tournament)
+
+    def group(self, tournament: np.ndarray, map: np.ndarray, key: np.ndarray, size: int,
+              values: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sums values for each (tournament, map, key) group, including the "Overall" rollups.
+
+        Parameters
+        ----------
+        tournament, map, key : np.ndarray
+            The codes of each pick.
+        size : int
+            The number of possible keys.
+        values : list[np.ndarray]
+            The values summed for each pick.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The (tournament, map, key) codes of each group, shape (groups, 3), and the summed
+            values, shape (groups, len(values)).
+        """
+
+        ovr_tour = np.full_like(tournament, len(self.tournaments) - 1)
+        ovr_map = np.full_like(map, len(self.maps) - 1)
+        tournament = np.concatenate([tournament, tournament, ovr_tour, ovr_tour]).astype(np.int64)
+        map = np.concatenate([map, ovr_map, map, ovr_map]).astype(np.int64)
+        key = np.tile(key, 4).astype(np.int64)
+
+        combined = (tournament * len(self.maps) + map) * size + key
+        groups, inverse = np.unique(combined, return_inverse=True)
+        sums = np.stack([np.bincount(inverse, weights=np.tile(value, 4), minlength=len(groups))
+                         for value in values], axis=1).astype(np.int64)
+
+        codes = np.stack([groups // size // len(self.maps), groups // size % len(self.maps),
+                          groups % size], axis=1)
+        return codes, sums
+
+    def map_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        """Games, CT round wins and T round wins for each (tournament, map)."""
+        ct_wins = self.half[:, 0].astype(np.int64) + self.half_2[:, 1]
+        t_wins = self.half_2[:, 0].astype(np.int64) + self.half[:, 1]
+        codes, sums = self.group(self.tournament, self.map, np.zeros_like(self.map), 1,
+                                 [np.ones(len(self)), ct_wins, t_wins])
+        return codes[:, :2], sums
+
+    def team_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        """Games and wins for each (tournament, map, team)."""
+        return self.group(np.repeat(self.tournament, 2), np.repeat(self.map, 2),
+                          self.team.ravel(), len(self.teams),
+                          [np.ones(2 * len(self)), self.won.ravel()])
+
+    def agent_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        """Games and wins for each (tournament, map, agent)."""
+        return self.group(np.repeat(self.tournament, 10), np.repeat(self.map, 10),
+                          self.agent.ravel(), len(self.agents),
+                          [np.ones(10 * len(self)), np.repeat(self.won.ravel(), 5)])
+
+    def comp_totals(self) -> tuple[np.ndarray, np.ndarray]:
+        """Games and wins for each (tournament, map, comp)."""
+        return self.group(np.repeat(self.tournament, 2), np.repeat(self.map, 2),
+                          self.comp.ravel(), len(self.comps),
+                          [np.ones(2 * len(self)), self.won.ravel()])
+
+    def totals(self) -> dict[str, dict]:
+        """
+        Totals of every match in the same form as the batches of an :class:`~new_game.Ingest`.
+
+        Returns
+        -------
+        dict[str, dict]
+            The "tournaments", "maps", "agents", "teams" and "comps" increments, keyed by names.
+        """
+
+        totals = dict(tournaments={}, maps={}, agents={}, teams={}, comps={})
+
+        codes, sums = self.map_totals()
+        for (tournament, map), row in zip(codes.tolist(), sums.tolist()):
+            if map == len(self.maps) - 1:
+                totals["tournaments"][self.tournaments[tournament]] = row[0]
+            totals["maps"][(self.tournaments[tournament], self.maps[map])] = row
+
+        for names, (codes, sums), rows in [(self.teams, self.team_totals(), totals["teams"]),
+                                           (self.agents, self.agent_totals(), totals["agents"])]:
+            for (tournament, map, key), row in zip(codes.tolist(), sums.tolist()):
+                rows[(self.tournaments[tournament], self.maps[map], names[key])] = row
+
+        codes, sums = self.comp_totals()
+        for (tournament, map, comp), row in zip(codes.tolist(), sums.tolist()):
+            totals["comps"][(self.tournaments[tournament], self.maps[map],
+                             *self.agents[self.comps[comp]])] = row
+
+        return totals
+
+    def fill(self, ingest) -> None:
+        """
+        Adds the totals of every match to an :class:`~new_game.Ingest` batch.
+
+        Parameters
+        ----------
+        ingest : Ingest
+        """
+
+        merge(ingest, self.totals())
+
+
+def merge(ingest, totals: dict[str, dict]) -> None:
+    """
+    Adds totals from :meth:`MatchArrays.totals` to an :class:`~new_game.Ingest` batch.
+
+    Parameters
+    ----------
+    ingest : Ingest
+    totals : dict[str, dict]
+    """
+
+    for tournament, games in totals["tournaments"].items():
+        ingest.tournaments[tournament] += games
+    for name in ["maps", "agents", "teams", "comps"]:
+        rows = getattr(ingest, name)
+        for key, values in totals[name].items():
+            row = rows[key]
+            for i, value in enumerate(values):
+                row[i] += value
+
+
+def partition_totals(url: str, tournament: str) -> dict[str, dict]:
+    """
+    Loads the matches of one tournament in a new connection and finds their totals. Used by the
+    worker processes of :func:`parallel_totals`.
+
+    Parameters
+    ----------
+    url : str
+        The database URL.
+    tournament : str
+
+    Returns
+    -------
+    dict[str, dict]
+    """
+
+    engine = create_engine(url)
+    try:
+        with Session(engine) as session:
+            return MatchArrays(session, tournament).totals()
+    finally:
+        engine.dispose()
+
+
+def parallel_totals(session: Session, processes: int = None) -> list[dict[str, dict]]:
+    """
+    Splits the matches by tournament and finds the totals of each tournament in a pool of worker
+    processes.
+
+    Parameters
+    ----------
+    session : Session
+    processes : int, default: None
+        The number of worker processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    list[dict[str, dict]]
+        The totals of each tournament, including its share of the "Overall" rows.
+    """
+
+    url = session.get_bind().url.render_as_string(hide_password=False)
+    tournaments = session.scalars(select(Match.tournament).distinct()).all()
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(partition_totals, repeat(url), tournaments))
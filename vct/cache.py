@@ -0,0 +1,205 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Mapping, Optional
+
+import requests
+
+MATCH_STATUS = re.compile(r'class="match-header-vs-note[^"]*">\s*(\w+)')
+TTLS = {
+    "completed": None,
+    "match": datetime.timedelta(minutes=10),
+    "event": datetime.timedelta(hours=1),
+    "agents": datetime.timedelta(days=1),
+    "other": datetime.timedelta(hours=1)}
+
+
+class CacheMiss(requests.RequestException):
+    """Raised when a page that has not been cached is requested while offline."""
+
+
+def page_class(url: str, html: Optional[str] = None) -> str:
+    """
+    Finds the kind of vlr.gg page a url is for, which decides how long it is cached.
+
+    Parameters
+    ----------
+    url : str
+    html : Optional[str], default: None
+        The page, used to tell whether a match has been completed.
+
+    Returns
+    -------
+    {"completed", "match", "event", "agents", "other"}
+        Completed matches, matches still to be played, a tournament's matches list, a
+        tournament's agent stats, or anything else.
+    """
+
+    parts = url.split("/")
+    if len(parts) > 4 and parts[3] == "event":
+        return {"matches": "event", "agents": "agents"}.get(parts[4], "other")
+    if len(parts) > 3 and parts[3].isdigit():
+        status = MATCH_STATUS.search(html or "")
+        return "completed" if status is not None and status.group(1) == "final" else "match"
+    return "other"
+
+
+class ResponseCache:
+    def __init__(self, directory: str = "VLRCache",
+                 ttls: Optional[dict[str, Optional[datetime.timedelta]]] = None,
+                 offline: bool = False):
+        """
+        On-disk cache of fetched pages. Pages are stored compressed under the hash of their
+        content, so a page which has not changed is only stored once, with an index entry for each
+        url pointing to its page and when it was fetched. Each kind of page is kept for its own
+        time to live, and completed matches are kept forever. The ETag and Last-Modified headers
+        of each page are kept so an expired page can be requested conditionally and, if it has
+        not changed, used again. When offline, pages are only read from the cache, whatever their
+        age.
+
+        Parameters
+        ----------
+        directory : str, default: "VLRCache"
+        ttls : Optional[dict[str, Optional[datetime.timedelta]]], default: None
+            Time to live for each kind of page from :func:`page_class`, with None never expiring.
+            Given kinds replace the defaults in ``TTLS``.
+        offline : bool, default: False
+            Whether to serve only from the cache.
+        """
+
+        self.directory = directory
+        self.ttls = TTLS | (ttls or {})
+        self.offline = offline
+
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self.directory, "index",
+                            hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _page_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "pages", digest[:2], digest)
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            file.write(data)
+        os.replace(temp, path)
+
+    def _entry(self, url: str) -> Optional[dict[str, str]]:
+        """The index entry of a url, if its page is cached."""
+        try:
+            with open(self._index_path(url)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._page_path(entry.get("digest", ""))):
+            return None
+        return entry
+
+    def _read(self, entry: dict[str, str]) -> str:
+        with open(self._page_path(entry["digest"]), "rb") as file:
+            return zlib.decompress(file.read()).decode()
+
+    def get(self, url: str) -> Optional[str]:
+        """
+        Finds a cached page.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        Optional[str]
+            The page, or None if it is not cached or has expired.
+
+        Raises
+        ------
+        CacheMiss
+            If offline and the page is not cached.
+        """
+
+        entry = self._entry(url)
+        if entry is None:
+            if self.offline:
+                raise CacheMiss(f"{url} has not been cached")
+            return None
+
+        if not self.offline:
+            ttl = self.ttls.get(entry["class"])
+            fetched = datetime.datetime.fromisoformat(entry["fetched"])
+            if ttl is not None and datetime.datetime.now() - fetched > ttl:
+                return None
+        return self._read(entry)
+
+    def validators(self, url: str) -> dict[str, str]:
+        """
+        Headers making a request for a cached page conditional.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        dict[str, str]
+            If-None-Match and If-Modified-Since from the cached page's ETag and Last-Modified,
+            empty if the page is not cached or had neither.
+        """
+
+        entry = self._entry(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def revalidate(self, url: str) -> Optional[str]:
+        """
+        Renews a cached page after the server found it has not been modified.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        Optional[str]
+            The cached page, or None if it is not cached.
+        """
+
+        entry = self._entry(url)
+        if entry is None:
+            return None
+        entry["fetched"] = datetime.datetime.now().isoformat()
+        self._write(self._index_path(url), json.dumps(entry).encode())
+        return self._read(entry)
+
+    def put(self, url: str, html: str, headers: Optional[Mapping[str, str]] = None) -> None:
+        """
+        Stores a page fetched from a url.
+
+        Parameters
+        ----------
+        url : str
+        html : str
+        headers : Optional[Mapping[str, str]], default: None
+            The response headers, from which the ETag and Last-Modified are kept.
+        """
+
+        data = html.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._page_path(digest)
+        if not os.path.exists(path):
+            self._write(path, zlib.compress(data))
+        headers = headers or {}
+        entry = {"url": url, "digest": digest, "class": page_class(url, html),
+                 "fetched": datetime.datetime.now().isoformat(), "etag": headers.get("ETag"),
+                 "last_modified": headers.get("Last-Modified")}
+        self._write(self._index_path(url), json.dumps(entry).encode())
@@ -61,7 +61,8 @@ def copy_data(old_db: str, new_db: str):
                           team_2_agent_2=match.team_2_agent_2,
                           team_2_agent_3=match.team_2_agent_3,
                           team_2_agent_4=match.team_2_agent_4,
-                          team_2_agent_5=match.team_2_agent_5)
+                          team_2_agent_5=match.team_2_agent_5,
+                          code=match.code)
         session_2.add(new_match)
 
     session_2.commit()
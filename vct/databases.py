@@ -1,8 +1,87 @@
-from sqlalchemy import ForeignKey, ForeignKeyConstraint
-from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship
+import datetime
+from typing import Any, Callable, Optional
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import (Connection, Dialect, ForeignKey, ForeignKeyConstraint, Index, String,
+                        column, event, inspect, select, table)
+from sqlalchemy.orm import declarative_base, Mapped, mapped_column, relationship, Session
 
 base = declarative_base()
 
+DICTIONARIES = {"referall": table("referall", column("name"), column("id")),
+                "tournaments": table("tournaments", column("tournament"), column("id"))}
+SETTINGS = table("settings", column("name"), column("value"))
+KEYS = WeakKeyDictionary()
+
+
+def _keys(dialect: Dialect) -> dict[str, tuple[dict[str, int], dict[int, str]]]:
+    """The ids and names of each dictionary for a dialect, updated in place by load_keys."""
+    if dialect not in KEYS:
+        KEYS[dialect] = dict([(name, ({}, {})) for name in DICTIONARIES])
+    return KEYS[dialect]
+
+
+class Key(String):
+    def __init__(self, dictionary: str = "referall"):
+        """
+        Type of the columns holding the name of a map, agent, team or tournament. When the
+        database's "keys" setting is "ids" the names are stored as their integer id in the
+        referall or tournaments table. Bound names are swapped for their ids and selected ids for
+        their names in Python, from the ids loaded by :func:`load_keys`, so queries still compare
+        and return names. Names without an id, and the "Overall" rows, are always stored as text.
+
+        Parameters
+        ----------
+        dictionary : {"referall", "tournaments"}, default: "referall"
+            The table the ids come from.
+        """
+
+        super().__init__()
+        self.dictionary = dictionary
+
+    def bind_processor(self, dialect: Dialect) -> Callable[[Optional[str]], Any]:
+        ids = _keys(dialect)[self.dictionary][0].get
+
+        def process(value: Optional[str]) -> Any:
+            return ids(value, value)
+        return process
+
+    def result_processor(self, dialect: Dialect, coltype: Any) -> Callable[[Any], Optional[str]]:
+        names = _keys(dialect)[self.dictionary][1].get
+
+        def process(value: Any) -> Optional[str]:
+            return names(value, value)
+        return process
+
+
+def load_keys(connection: Connection) -> None:
+    """
+    Function to load the ids used by :class:`Key` columns when the database's "keys" setting is
+    "ids", or to clear them in the "names" mode. It is run at the start of every session
+    transaction, and again whenever ids are assigned or the setting changes.
+
+    Parameters
+    ----------
+    connection : Connection
+    """
+
+    ids = inspect(connection).has_table("settings") and connection.scalar(
+        select(SETTINGS.c.value).where(SETTINGS.c.name == "keys")) == "ids"
+    for name, (keys, names) in _keys(connection.dialect).items():
+        keys.clear()
+        names.clear()
+        if ids:
+            dictionary = DICTIONARIES[name]
+            rows = connection.execute(select(dictionary.c[0], dictionary.c.id).where(
+                dictionary.c.id.is_not(None), dictionary.c[0] != "Overall")).all()
+            keys.update(rows)
+            names.update([(id, key) for key, id in rows])
+
+
+@event.listens_for(Session, "after_begin")
+def _load_keys(session: Session, transaction, connection: Connection) -> None:
+    load_keys(connection)
+
 
 class Tournament(base):
     __tablename__ = "tournaments"
@@ -13,6 +92,7 @@ class Tournament(base):
     map_pool: Mapped[str]
     agent_pool: Mapped[str]
     team_pool: Mapped[str]
+    id: Mapped[Optional[int]] = mapped_column(unique=True, index=True)
 
 
 class Referall(base):
@@ -21,14 +101,78 @@ class Referall(base):
     name: Mapped[str] = mapped_column(primary_key=True)
 
     abbreviation: Mapped[str] = mapped_column(unique=True)
+    type: Mapped[str]
+    bit: Mapped[Optional[int]] = mapped_column(unique=True, index=True)
+    id: Mapped[Optional[int]] = mapped_column(unique=True, index=True)
+
+
+class Setting(base):
+    __tablename__ = "settings"
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+
+    value: Mapped[str]
+
+
+class PendingReferall(base):
+    __tablename__ = "pending_referalls"
+
+    name: Mapped[str] = mapped_column(ForeignKey("referall.name"), primary_key=True)
+
     type: Mapped[str]
 
+    referall_ref: Mapped[Referall] = relationship("Referall", foreign_keys=name)
+
+
+class ScannedMatch(base):
+    __tablename__ = "scanned_matches"
+
+    code: Mapped[str] = mapped_column(primary_key=True)
+
+
+class ScrapeJob(base):
+    __tablename__ = "scrape_jobs"
+
+    url: Mapped[str] = mapped_column(primary_key=True)
+
+    kind: Mapped[str]
+    state: Mapped[str] = mapped_column(index=True)
+    attempts: Mapped[int]
+    created: Mapped[datetime.datetime]
+    updated: Mapped[datetime.datetime]
+    html: Mapped[Optional[str]]
+    record: Mapped[Optional[str]]
+    error: Mapped[Optional[str]]
+    digest: Mapped[Optional[str]]
+    priority: Mapped[Optional[int]]
+
+
+class WatchedEvent(base):
+    __tablename__ = "watched_events"
+
+    url: Mapped[str] = mapped_column(primary_key=True)
+
+    next_poll: Mapped[datetime.datetime]
+    last_polled: Mapped[Optional[datetime.datetime]]
+    finished: Mapped[bool]
+
+
+class MatchPage(base):
+    __tablename__ = "match_pages"
+
+    code: Mapped[str] = mapped_column(primary_key=True)
+
+    url: Mapped[str]
+    fetched: Mapped[datetime.datetime]
+    html: Mapped[bytes]
+
 
 class Map(base):
     __tablename__ = "maps"
 
-    tournament: Mapped[str] = mapped_column(ForeignKey("tournaments.tournament"), primary_key=True)
-    map: Mapped[str] = mapped_column(ForeignKey("referall.name"), primary_key=True)
+    tournament: Mapped[str] = mapped_column(Key("tournaments"),
+                                            ForeignKey("tournaments.tournament"), primary_key=True)
+    map: Mapped[str] = mapped_column(Key(), ForeignKey("referall.name"), primary_key=True)
 
     games: Mapped[int]
     ct_wins: Mapped[int]
@@ -41,10 +185,10 @@ class Map(base):
 class Agent(base):
     __tablename__ = "agents"
 
-    tournament: Mapped[str] = mapped_column(ForeignKey("tournaments.tournament"),
-                                            primary_key=True)
-    map: Mapped[str] = mapped_column(primary_key=True)
-    agent: Mapped[str] = mapped_column(ForeignKey("referall.name"), primary_key=True)
+    tournament: Mapped[str] = mapped_column(Key("tournaments"),
+                                            ForeignKey("tournaments.tournament"), primary_key=True)
+    map: Mapped[str] = mapped_column(Key(), primary_key=True)
+    agent: Mapped[str] = mapped_column(Key(), ForeignKey("referall.name"), primary_key=True)
 
     games: Mapped[int]
     wins: Mapped[int]
@@ -64,10 +208,10 @@ class Agent(base):
 class Team(base):
     __tablename__ = "teams"
 
-    tournament: Mapped[str] = mapped_column(ForeignKey("tournaments.tournament"),
-                                            primary_key=True)
-    map: Mapped[str] = mapped_column(primary_key=True)
-    team: Mapped[str] = mapped_column(ForeignKey("referall.name"), primary_key=True)
+    tournament: Mapped[str] = mapped_column(Key("tournaments"),
+                                            ForeignKey("tournaments.tournament"), primary_key=True)
+    map: Mapped[str] = mapped_column(Key(), primary_key=True)
+    team: Mapped[str] = mapped_column(Key(), ForeignKey("referall.name"), primary_key=True)
 
     games: Mapped[int]
     wins: Mapped[int]
@@ -87,18 +231,19 @@ class Team(base):
 class Comp(base):
     __tablename__ = "comps"
 
-    tournament: Mapped[str] = mapped_column(ForeignKey("tournaments.tournament"),
-                                            primary_key=True)
-    map: Mapped[str] = mapped_column(primary_key=True)
-    agent_1: Mapped[str] = mapped_column(primary_key=True)
-    agent_2: Mapped[str] = mapped_column(primary_key=True)
-    agent_3: Mapped[str] = mapped_column(primary_key=True)
-    agent_4: Mapped[str] = mapped_column(primary_key=True)
-    agent_5: Mapped[str] = mapped_column(primary_key=True)
+    tournament: Mapped[str] = mapped_column(Key("tournaments"),
+                                            ForeignKey("tournaments.tournament"), primary_key=True)
+    map: Mapped[str] = mapped_column(Key(), primary_key=True)
+    agent_1: Mapped[str] = mapped_column(Key())
+    agent_2: Mapped[str] = mapped_column(Key())
+    agent_3: Mapped[str] = mapped_column(Key())
+    agent_4: Mapped[str] = mapped_column(Key())
+    agent_5: Mapped[str] = mapped_column(Key())
 
     games: Mapped[int]
     wins: Mapped[int]
     ref: Mapped[str]
+    mask: Mapped[int] = mapped_column(primary_key=True)
 
     tournament_ref: Mapped[Tournament] = relationship("Tournament", foreign_keys=tournament)
     map_ref: Mapped[Map] = relationship("Map", foreign_keys=[tournament, map])
@@ -139,28 +284,32 @@ class Comp(base):
 class Match(base):
     __tablename__ = "matches"
 
-    tournament: Mapped[str] = mapped_column(ForeignKey("tournaments.tournament"))
-    map: Mapped[str] = mapped_column()
+    tournament: Mapped[str] = mapped_column(Key("tournaments"),
+                                            ForeignKey("tournaments.tournament"))
+    map: Mapped[str] = mapped_column(Key())
 
-    team_1: Mapped[str] = mapped_column()
+    team_1: Mapped[str] = mapped_column(Key())
     team_1_score: Mapped[int]
     team_2_score: Mapped[int]
-    team_2: Mapped[str] = mapped_column()
+    team_2: Mapped[str] = mapped_column(Key())
     team_1_half: Mapped[int]
     team_2_half: Mapped[int]
     team_1_half_2: Mapped[int]
     team_2_half_2: Mapped[int]
 
-    team_1_agent_1: Mapped[str] = mapped_column()
-    team_1_agent_2: Mapped[str] = mapped_column()
-    team_1_agent_3: Mapped[str] = mapped_column()
-    team_1_agent_4: Mapped[str] = mapped_column()
-    team_1_agent_5: Mapped[str] = mapped_column()
-    team_2_agent_1: Mapped[str] = mapped_column()
-    team_2_agent_2: Mapped[str] = mapped_column()
-    team_2_agent_3: Mapped[str] = mapped_column()
-    team_2_agent_4: Mapped[str] = mapped_column()
-    team_2_agent_5: Mapped[str] = mapped_column()
+    team_1_agent_1: Mapped[str] = mapped_column(Key())
+    team_1_agent_2: Mapped[str] = mapped_column(Key())
+    team_1_agent_3: Mapped[str] = mapped_column(Key())
+    team_1_agent_4: Mapped[str] = mapped_column(Key())
+    team_1_agent_5: Mapped[str] = mapped_column(Key())
+    team_2_agent_1: Mapped[str] = mapped_column(Key())
+    team_2_agent_2: Mapped[str] = mapped_column(Key())
+    team_2_agent_3: Mapped[str] = mapped_column(Key())
+    team_2_agent_4: Mapped[str] = mapped_column(Key())
+    team_2_agent_5: Mapped[str] = mapped_column(Key())
+    team_1_mask: Mapped[Optional[int]]
+    team_2_mask: Mapped[Optional[int]]
+    code: Mapped[Optional[str]] = mapped_column(index=True)
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
     tournament_ref: Mapped[Tournament] = relationship("Tournament", foreign_keys=tournament)
@@ -177,10 +326,10 @@ class Match(base):
                                                      foreign_keys=[tournament, map, team_1_agent_4])
     team_1_agent_5_ref: Mapped[Agent] = relationship("Agent",
                                                      foreign_keys=[tournament, map, team_1_agent_5])
-    team_1_comp_ref: Mapped[Comp] = relationship("Comp",
-                                                 foreign_keys=[tournament, map, team_1_agent_1,
-                                                               team_1_agent_2, team_1_agent_3,
-                                                               team_1_agent_4, team_1_agent_5])
+    team_1_comp_ref: Mapped[Comp] = relationship(
+        "Comp", primaryjoin="and_(foreign(Match.tournament) == Comp.tournament, "
+                            "foreign(Match.map) == Comp.map, "
+                            "foreign(Match.team_1_mask) == Comp.mask)", viewonly=True)
     team_2_agent_1_ref: Mapped[Agent] = relationship("Agent",
                                                      foreign_keys=[tournament, map, team_2_agent_1])
     team_2_agent_2_ref: Mapped[Agent] = relationship("Agent",
@@ -191,10 +340,10 @@ class Match(base):
                                                      foreign_keys=[tournament, map, team_2_agent_4])
     team_2_agent_5_ref: Mapped[Agent] = relationship("Agent",
                                                      foreign_keys=[tournament, map, team_2_agent_5])
-    team_2_comp_ref: Mapped[Comp] = relationship("Comp",
-                                                 foreign_keys=[tournament, map, team_2_agent_1,
-                                                               team_2_agent_2, team_2_agent_3,
-                                                               team_2_agent_4, team_2_agent_5])
+    team_2_comp_ref: Mapped[Comp] = relationship(
+        "Comp", primaryjoin="and_(foreign(Match.tournament) == Comp.tournament, "
+                            "foreign(Match.map) == Comp.map, "
+                            "foreign(Match.team_2_mask) == Comp.mask)", viewonly=True)
 
     __table_args__ = (
         ForeignKeyConstraint(
@@ -262,3 +411,28 @@ class Match(base):
              "comps.agent_4", "comps.agent_5"]
         )
     )
+
+
+class MatchAgent(base):
+    __tablename__ = "match_agents"
+
+    match_id: Mapped[int] = mapped_column(ForeignKey("matches.id"), primary_key=True)
+    side: Mapped[int] = mapped_column(primary_key=True)
+    slot: Mapped[int] = mapped_column(primary_key=True)
+
+    tournament: Mapped[int] = mapped_column(ForeignKey("tournaments.id"))
+    map: Mapped[int] = mapped_column(ForeignKey("referall.id"))
+    agent: Mapped[int] = mapped_column(ForeignKey("referall.id"))
+    team: Mapped[int] = mapped_column(ForeignKey("referall.id"))
+    won: Mapped[bool]
+
+    match_ref: Mapped[Match] = relationship("Match", foreign_keys=match_id)
+    tournament_ref: Mapped[Tournament] = relationship("Tournament", foreign_keys=tournament)
+    map_ref: Mapped[Referall] = relationship("Referall", foreign_keys=map)
+    agent_ref: Mapped[Referall] = relationship("Referall", foreign_keys=agent)
+    team_ref: Mapped[Referall] = relationship("Referall", foreign_keys=team)
+
+    __table_args__ = (
+        Index("ix_match_agents_agent", "agent", "map", "tournament", "won", "match_id"),
+        Index("ix_match_agents_team", "team", "map", "tournament", "agent", "won", "match_id")
+    )
@@ -1,7 +1,60 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy import ColumnElement, Engine, bindparam, create_engine, inspect, select, text
+from sqlalchemy.orm import Session, aliased
+
+from .databases import (Tournament, Map, Agent, Comp, Team, Match, MatchAgent, Referall,
+                        PendingReferall, Setting, Key, base, load_keys)
+
+COMP_REF_SQL = (
+    "UPDATE comps SET ref = " + " || ' ' || ".join(
+        [f"COALESCE((SELECT abbreviation FROM referall WHERE {{referall}} = agent_{n}), agent_{n})"
+         for n in range(1, 6)]) +
+    " WHERE " + " OR ".join(
+        [f"agent_{n} IN (SELECT {{referall}} FROM referall WHERE name IN :names)"
+         for n in range(1, 6)]))
+
+MASK_SQL = "UPDATE matches SET " + ", ".join(
+    [f"team_{team}_mask = (SELECT SUM(1 << bit) FROM referall WHERE {{referall}} IN (" +
+     ", ".join([f"team_{team}_agent_{n}" for n in range(1, 6)]) + "))" for team in (1, 2)])
+
+COMP_MASK_SQL = """INSERT INTO comps (tournament, map, agent_1, agent_2, agent_3, agent_4, agent_5,
+                   games, wins, ref, mask)
+SELECT tournament, map, agent_1, agent_2, agent_3, agent_4, agent_5, games, wins, ref, {mask}
+FROM comps_old{joins}""".format(
+    mask=" | ".join([f"(1 << ref_{n}.bit)" for n in range(1, 6)]),
+    joins="".join([f"\nJOIN referall AS ref_{n} ON ref_{n}.{{referall}} = agent_{n}"
+                   for n in range(1, 6)]))
+
+
+def match_agents_sql(where: str = "") -> str:
+    """
+    Builds the statement filling the match_agents table from the matches table.
+
+    Parameters
+    ----------
+    where : str, default: ""
+        An optional condition on the matches that are added.
+
+    Returns
+    -------
+    str
+        The statement, with the placeholders filled by :func:`key_columns`.
+    """
+
+    return """INSERT INTO match_agents (match_id, side, slot, tournament, map, agent, team,
+                          won)
+""" + "\nUNION ALL\n".join(
+        [f"""SELECT matches.id, {side}, {slot}, tournaments.id, maps.id, agents.id, teams.id, {won}
+FROM matches
+JOIN tournaments ON tournaments.{{tournaments}} = matches.tournament
+JOIN referall AS maps ON maps.{{referall}} = matches.map
+JOIN referall AS agents ON agents.{{referall}} = matches.team_{side}_agent_{slot}
+JOIN referall AS teams ON teams.{{referall}} = matches.team_{side}"""
+         + (f"\nWHERE {where}" if where else "")
+         for side, won in [(1, "team_1_score > team_2_score"), (2, "team_1_score <= team_2_score")]
+         for slot in range(1, 6)])
+
 
-from .databases import Tournament, Map, Agent, Team, Referall, base
+MATCH_AGENTS_SQL = match_agents_sql()
 
 
 def choice_check(question: str, options: list[str | int]) -> str:
@@ -101,6 +154,414 @@ def divide(numerator: int, denominator: int, offset=0) -> float:
     return result
 
 
+def get_setting(name: str, session: Session, default: str = None) -> str:
+    """
+    Function to read a stored setting of the database.
+
+    Parameters
+    ----------
+    name : str
+        The name of the setting.
+    session : Session
+    default : str, default: None
+        The value returned if the setting has not been stored.
+
+    Returns
+    -------
+    str
+        The value of the setting.
+    """
+
+    if not inspect(session.connection()).has_table(Setting.__tablename__):
+        return default
+    setting = session.get(Setting, name)
+    if setting is None:
+        return default
+    return setting.value
+
+
+def set_setting(name: str, value: str, session: Session) -> None:
+    """
+    Function to store a setting of the database. The change is not committed.
+
+    Parameters
+    ----------
+    name : str
+        The name of the setting.
+    value : str
+        The new value of the setting.
+    session : Session
+    """
+
+    Setting.__table__.create(bind=session.connection(), checkfirst=True)
+    setting = session.get(Setting, name)
+    if setting is None:
+        session.add(Setting(name=name, value=value))
+    else:
+        setting.value = value
+
+
+def key_columns(session: Session) -> dict[str, str]:
+    """
+    Function to find the columns of the referall and tournaments tables that the names in the
+    other tables are stored as, to fill the ``{referall}`` and ``{tournaments}`` placeholders of
+    the SQL statements joining on them.
+
+    Parameters
+    ----------
+    session : Session
+
+    Returns
+    -------
+    dict[str, str]
+        "id" for both tables in the "ids" keys mode, otherwise "name" and "tournament".
+    """
+
+    if get_setting("keys", session, "names") == "ids":
+        return dict(referall="id", tournaments="id")
+    return dict(referall="name", tournaments="tournament")
+
+
+def fill_pool(rows: list[Map | Agent | Team], table: type[Map | Agent | Team],
+              tournaments: list[str], maps: list[str], session: Session,
+              keys: list[str] = None) -> list[Map | Agent | Team]:
+    """
+    Function to add a zero count entry for every map, agent or team in the pools of the given
+    tournaments that has no stored row. Rows are only left out of the tables when the "sparse"
+    storage mode is used, otherwise :attr:`rows` is returned unchanged.
+
+    Parameters
+    ----------
+    rows : list[Map | Agent | Team]
+        The stored rows found by a query.
+    table : type[Map | Agent | Team]
+        The table that was queried.
+    tournaments : list[str]
+        The tournaments covered by the query.
+    maps : list[str]
+        The maps covered by the query.
+    session : Session
+    keys : list[str], default: None
+        The agents or teams covered by the query. All of the pool is covered if not given.
+
+    Returns
+    -------
+    list[Map | Agent | Team]
+        The rows with the zero count entries added. Added entries are not part of the session.
+    """
+
+    if get_setting("storage", session, "dense") != "sparse":
+        return rows
+
+    key = {Map: "map", Agent: "agent", Team: "team"}[table]
+    existing = set([(row.tournament, row.map, getattr(row, key)) for row in rows])
+    map_rows = dict([((map.tournament, map.map), map) for map in session.query(Map).where(
+        Map.tournament.in_(tournaments))])
+
+    rows = list(rows)
+    for tournament in session.query(Tournament).where(Tournament.tournament.in_(tournaments)):
+        for map in ["Overall"] + tournament.map_pool.split(" - "):
+            if map not in maps:
+                continue
+            map_row = map_rows.get((tournament.tournament, map))
+            if map_row is None:
+                map_row = Map(tournament=tournament.tournament, map=map, games=0, ct_wins=0,
+                              t_wins=0, tournament_ref=tournament)
+            if table is Map:
+                if (tournament.tournament, map, map) not in existing:
+                    rows.append(map_row)
+                continue
+            for name in getattr(tournament, f"{key}_pool").split(" - "):
+                if (tournament.tournament, map, name) in existing or (keys is not None and
+                                                                      name not in keys):
+                    continue
+                rows.append(table(**{"tournament": tournament.tournament, "map": map,
+                                     key: name, "games": 0, "wins": 0,
+                                     "tournament_ref": tournament, "map_ref": map_row}))
+    return rows
+
+
+def assign_ids(table: type[Tournament | Referall], session: Session) -> dict[str, int]:
+    """
+    Function to find the integer id of each tournament or referall. Rows without an id are given
+    the next free id, the change is not committed.
+
+    Parameters
+    ----------
+    table : type[Tournament | Referall]
+    session : Session
+
+    Returns
+    -------
+    dict[str, int]
+        The id of each tournament or referall name.
+    """
+
+    key = "tournament" if table is Tournament else "name"
+    rows = session.query(table).all()
+    id = max([row.id for row in rows if row.id is not None], default=0) + 1
+    assigned = False
+    for row in rows:
+        if row.id is None:
+            row.id = id
+            id += 1
+            assigned = True
+    session.flush()
+    if assigned and get_setting("keys", session, "names") == "ids":
+        encode_keys(session)
+    return dict([(getattr(row, key), row.id) for row in rows])
+
+
+def encode_keys(session: Session) -> None:
+    """
+    Function to store every name in the key columns as its id in the "ids" keys mode, or every id
+    as its name in the "names" mode. The "Overall" rows and names without an id are left as text.
+    The ids used by the :class:`~databases.Key` columns are reloaded. The change is not committed.
+
+    Parameters
+    ----------
+    session : Session
+    """
+
+    ids = get_setting("keys", session, "names") == "ids"
+    for table in base.metadata.sorted_tables:
+        for column in table.columns:
+            if not isinstance(column.type, Key):
+                continue
+            dictionary = column.type.dictionary
+            name = "tournament" if dictionary == "tournaments" else "name"
+            key = f"{table.name}.{column.name}"
+            if ids:
+                session.execute(text(
+                    f"UPDATE {table.name} SET {column.name} = (SELECT id FROM {dictionary} "
+                    f"WHERE {dictionary}.{name} = {key}) WHERE typeof({key}) = 'text' AND "
+                    f"{key} != 'Overall' AND {key} IN "
+                    f"(SELECT {name} FROM {dictionary} WHERE id IS NOT NULL)"))
+            else:
+                session.execute(text(
+                    f"UPDATE {table.name} SET {column.name} = (SELECT {name} FROM {dictionary} "
+                    f"WHERE {dictionary}.id = {key}) WHERE typeof({key}) = 'integer'"))
+    load_keys(session.connection())
+
+
+def agent_bits(session: Session) -> dict[str, int]:
+    """
+    Function to find the bit of each agent used in comp masks. Agents without a bit are given the
+    next free bit, the change is not committed.
+
+    Parameters
+    ----------
+    session : Session
+
+    Returns
+    -------
+    dict[str, int]
+        The bit of each agent.
+    """
+
+    agents = session.query(Referall).where(Referall.type == "AGENT").order_by(Referall.name).all()
+    used = [agent.bit for agent in agents if agent.bit is not None]
+    bit = max(used, default=-1) + 1
+    for agent in agents:
+        if agent.bit is None:
+            if bit > 62:
+                raise ValueError("Too many agents for a comp mask.")
+            agent.bit = bit
+            bit += 1
+    session.flush()
+    return dict([(agent.name, agent.bit) for agent in agents])
+
+
+def comp_mask(agents: list[str], bits: dict[str, int]) -> int:
+    """
+    Function to find the integer mask of a comp.
+
+    Parameters
+    ----------
+    agents : list[str]
+    bits : dict[str, int]
+        The bit of each agent, from :func:`agent_bits`.
+
+    Returns
+    -------
+    int
+    """
+
+    mask = 0
+    for agent in agents:
+        mask |= 1 << bits[agent]
+    return mask
+
+
+def contains_agents(agents: list[str], session: Session) -> ColumnElement[bool]:
+    """
+    Function to create a filter for comps containing all of the given agents, e.g.
+    ``session.query(Comp).where(contains_agents(["JETT"], session))``.
+
+    Parameters
+    ----------
+    agents : list[str]
+    session : Session
+
+    Returns
+    -------
+    ColumnElement[bool]
+    """
+
+    mask = comp_mask(agents, agent_bits(session))
+    return Comp.mask.op("&")(mask) == mask
+
+
+def agent_matches(agent: str, session: Session, map: str = None,
+                  tournament: str = None) -> list[Match]:
+    """
+    Function to find every match an agent was played in, using the index of the match_agents table.
+
+    Parameters
+    ----------
+    agent : str
+    session : Session
+    map : str, default: None
+        Only find matches on this map.
+    tournament : str, default: None
+        Only find matches in this tournament.
+
+    Returns
+    -------
+    list[Match]
+    """
+
+    agent_ref = aliased(Referall)
+    query = select(MatchAgent.match_id).join(agent_ref, agent_ref.id == MatchAgent.agent).where(
+        agent_ref.name == agent)
+    if map is not None:
+        map_ref = aliased(Referall)
+        query = query.join(map_ref, map_ref.id == MatchAgent.map).where(map_ref.name == map)
+    if tournament is not None:
+        query = query.join(Tournament, Tournament.id == MatchAgent.tournament).where(
+            Tournament.tournament == tournament)
+    return session.query(Match).where(Match.id.in_(query)).order_by(Match.id).all()
+
+
+def provisional_abbreviation(name: str, session: Session) -> str:
+    """
+    Finds an unused abbreviation for a referall added without asking for one, the name itself if
+    it is free.
+
+    Parameters
+    ----------
+    name : str
+    session : Session
+
+    Returns
+    -------
+    str
+    """
+
+    used = set(session.scalars(select(Referall.abbreviation).where(
+        Referall.abbreviation.startswith(name))))
+    abbreviation, n = name, 1
+    while abbreviation in used:
+        n += 1
+        abbreviation = f"{name} {n}"
+    return abbreviation
+
+
+def resolve_referalls(abbreviations: dict[str, str], session: Session) -> None:
+    """
+    Sets the abbreviations of referalls that are waiting for one, in a single transaction, and
+    updates the refs of every comp using them. Every abbreviation is checked before any is set, so
+    either all of them are saved or none are.
+
+    Parameters
+    ----------
+    abbreviations : dict[str, str]
+        The new abbreviation for each referall name.
+    session : Session
+
+    Raises
+    ------
+    ValueError
+        If a name is not a referall, or an abbreviation is held by another referall, including one
+        being given a new abbreviation in the same call, or is given twice.
+    """
+
+    if not abbreviations:
+        return
+
+    referalls = dict([(referall.name, referall) for referall in session.query(Referall)])
+    owners = dict([(referall.abbreviation, name) for name, referall in referalls.items()])
+    chosen = set()
+    for name, abbreviation in abbreviations.items():
+        if name not in referalls:
+            raise ValueError(f"Unknown referall: {name}")
+        if owners.get(abbreviation, name) != name or abbreviation in chosen:
+            raise ValueError(f"Abbreviation already used: {abbreviation}")
+        chosen.add(abbreviation)
+
+    try:
+        for name, abbreviation in abbreviations.items():
+            referalls[name].abbreviation = abbreviation
+        session.flush()
+        session.query(PendingReferall).where(PendingReferall.name.in_(abbreviations)).delete()
+        session.execute(text(COMP_REF_SQL.format(**key_columns(session))).bindparams(
+            bindparam("names", expanding=True)), dict(names=list(abbreviations)))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def upgrade_database(engine: Engine) -> None:
+    """
+    Function to add any tables, columns and indexes missing from a database created by an older
+    version. The comps table is recreated when it is not yet keyed by the agent mask, and the
+    masks of the comps and matches and the match_agents table are filled in from the existing
+    data. Other added columns are empty until the data is refreshed.
+
+    Parameters
+    ----------
+    engine : Engine
+    """
+
+    tables = inspect(engine).get_table_names()
+    base.metadata.create_all(bind=engine)
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in base.metadata.sorted_tables:
+            columns = [column["name"] for column in inspector.get_columns(table.name)]
+            for column in table.columns:
+                if column.name not in columns:
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                        f"{column.type.compile(dialect=engine.dialect)}"))
+                    added.append(f"{table.name}.{column.name}")
+            indexes = [index["name"] for index in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(bind=connection)
+        rekey = inspector.get_pk_constraint("comps")["constrained_columns"] != [
+            "tournament", "map", "mask"]
+
+    with Session(engine) as session:
+        keys = key_columns(session)
+        if rekey:
+            agent_bits(session)
+            session.execute(text("ALTER TABLE comps RENAME TO comps_old"))
+            Comp.__table__.create(bind=session.connection())
+            session.execute(text(COMP_MASK_SQL.format(**keys)))
+            session.execute(text("DROP TABLE comps_old"))
+        if "matches.team_1_mask" in added:
+            agent_bits(session)
+            session.execute(text(MASK_SQL.format(**keys)))
+        if "match_agents" not in tables and "matches" in tables:
+            assign_ids(Tournament, session)
+            assign_ids(Referall, session)
+            session.execute(text(MATCH_AGENTS_SQL.format(**keys)))
+        session.commit()
+
+
 def create_database(name: str, session: Session) -> None:
     """
     Create a new database.
@@ -112,7 +573,7 @@ def create_database(name: str, session: Session) -> None:
     session : Session
     """
     engine = create_engine(f"sqlite:///{name}.db", echo=True)
-    base.metadata.create_all(bind=engine)
+    upgrade_database(engine)
     tournaments = [tournament.tournament for tournament in session.query(Tournament)]
     if "Overall" not in tournaments:
         maps = " - ".join([referall.name for referall in session.query(Referall).where(
@@ -133,7 +594,9 @@ def create_database(name: str, session: Session) -> None:
 
 def setup(tournament: Tournament, session: Session) -> None:
     """
-    Function to create all the required fields in the databases for a new tournament.
+    Function to create all the required fields in the databases for a new tournament. Nothing is
+    created when the "sparse" storage mode is used, as rows are then added on a map, agent or
+    team's first game.
 
     Parameter
     ---------
@@ -142,6 +605,9 @@ def setup(tournament: Tournament, session: Session) -> None:
     session : Session
     """
 
+    if get_setting("storage", session, "dense") == "sparse":
+        return
+
     maps = tournament.map_pool.split(" - ")
     agents = tournament.agent_pool.split(" - ")
     teams = tournament.team_pool.split(" - ")
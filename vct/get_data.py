@@ -1,15 +1,285 @@
 import requests
-from bs4 import BeautifulSoup, ResultSet
+from bs4 import BeautifulSoup, ResultSet, SoupStrainer
+import asyncio
 import datetime
 import re
-import copy
+import hashlib
+import json
+import os
 import pickle
-from typing import Optional
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
 
+from sqlalchemy import Row, delete, func, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
 
-from .databases import Match, Tournament, Referall
-from .functions import setup
+from .cache import CacheMiss, ResponseCache
+from .databases import (Match, MatchAgent, MatchPage, PendingReferall, ScannedMatch, ScrapeJob,
+                        Tournament, Referall, load_keys)
+from .functions import get_setting, provisional_abbreviation
+from .limiter import RateLimiter
+from .new_game import Ingest
+from .rebuild import rebuild, seed
+
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Scrape job priorities, lower priorities are scraped first.
+LIVE, MANUAL, RECENT, BACKFILL = range(4)
+
+MATCH_CLASSES = {"match-header-vs-note", "match-header-event", "vm-stats-game"}
+
+
+def match_page_tag(name: str, attrs: dict) -> bool:
+    """Whether a tag on a match page is read, skipping the stats for all maps combined."""
+    classes = attrs.get("class") or []
+    if isinstance(classes, str):
+        classes = classes.split()
+    return not MATCH_CLASSES.isdisjoint(classes) and attrs.get("data-game-id") != "all"
+
+
+MATCH_LIST = SoupStrainer("a", class_="match-item")
+MATCH_PAGE = SoupStrainer(match_page_tag)
+TOURNAMENT_PAGE = SoupStrainer("table", class_="wf-table")
+
+
+ETA_UNITS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
+
+def parse_match_schedule(html: str) -> list[dict[str, Any]]:
+    """
+    Reads every match on a tournament's matches page.
+
+    Parameters
+    ----------
+    html : str
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        For each match, the "href" relative to vlr.gg, the "status" in lower case, such as
+        "completed", "live" or "upcoming", the "eta" in seconds until an upcoming match starts if
+        it is shown, and whether it is a "showmatch".
+    """
+
+    matches_soup = BeautifulSoup(html, PARSER, parse_only=MATCH_LIST)
+    schedule = []
+    for match in matches_soup.find_all("a", class_="match-item"):
+        series = match.find("div", class_="match-item-event-series").text.split()
+        eta = match.find("div", class_="ml-eta")
+        units = re.findall(r"(\d+)\s*([wdhms])", eta.text) if eta is not None else []
+        schedule.append(dict(href=match["href"],
+                             status=match.find("div", class_="ml-status").text.strip().lower(),
+                             eta=sum([int(n) * ETA_UNITS[unit] for n, unit in units])
+                             if units else None,
+                             showmatch=bool(series) and series[0] == "Showmatch"))
+    return schedule
+
+
+def parse_match_list(html: str) -> list[str]:
+    """
+    Finds the completed matches on a tournament's matches page.
+
+    Parameters
+    ----------
+    html : str
+
+    Returns
+    -------
+    list[str]
+        The links to each match, relative to vlr.gg.
+    """
+
+    return [match["href"] for match in parse_match_schedule(html)
+            if match["status"] == "completed" and not match["showmatch"]]
+
+
+def parse_match(html: str) -> dict[str, Any]:
+    """
+    Reads a match page.
+
+    Parameters
+    ----------
+    html : str
+
+    Returns
+    -------
+    dict[str, Any]
+        "completed" is False if the match has not finished, otherwise "tournament" and
+        "tournament_link" give the tournament the match was played in and "maps" has a record
+        from :func:`parse_map` for each map.
+    """
+
+    soup = BeautifulSoup(html, PARSER, parse_only=MATCH_PAGE)
+    if soup.find("div", class_="match-header-vs-note").text.split()[0] != "final":
+        return dict(completed=False)
+
+    event = soup.find("a", class_="match-header-event")
+    maps = soup.find_all("div", class_="vm-stats-game")
+    return dict(completed=True, tournament=event.text.split("\t")[6].upper(),
+                tournament_link=event["href"], maps=[parse_map(map) for map in maps])
+
+
+def parse_archived_page(html: bytes) -> dict[str, Any]:
+    """Reads a compressed match page from the archive, as :func:`parse_match`."""
+    return parse_match(zlib.decompress(html).decode())
+
+
+def parse_map(soup: ResultSet) -> dict[str, Any]:
+    """
+    Reads a single map from a match page.
+
+    Parameters
+    ----------
+    soup : ResultSet
+        The map's section of the match page.
+
+    Returns
+    -------
+    dict[str, Any]
+        The "map", "teams" and "agents" played and the "match" columns, apart from the tournament.
+    """
+
+    map_name = soup.find("div", class_="map").text.split("\t")[7].upper()
+    teams = [team.text.split("\t")[7].upper()
+             for team in soup.find_all("div", class_="team-name")]
+
+    half_scores = soup.find_all("span", class_=re.compile("mod-(ct|t)"))[0:4]
+
+    if "mod-ct" in half_scores[0]["class"]:
+        ct, t = 0, 1
+    elif "mod-t" in half_scores[0]["class"]:
+        ct, t = 1, 0
+    else:
+        raise ValueError
+    half1 = [int(half_scores[0].text), int(half_scores[2].text)]
+    half2 = [int(half_scores[1].text), int(half_scores[3].text)]
+    scores = [int(score.text) for score in soup.find_all("div", class_=re.compile("score *"))]
+
+    agent_names = [agent.img.attrs["title"].upper()
+                   for agent in soup.find_all("span", class_="mod-agent")]
+
+    agents_1 = agent_names[:5]
+    agents_1.sort()
+    agents_2 = agent_names[5:]
+    agents_2.sort()
+    agents = [agents_1, agents_2]
+
+    match = dict(map=map_name,
+                 team_1=teams[ct],
+                 team_2=teams[t],
+                 team_1_score=scores[ct],
+                 team_2_score=scores[t],
+                 team_1_half=half1[ct],
+                 team_2_half=half1[t],
+                 team_1_half_2=half2[ct],
+                 team_2_half_2=half2[t],
+                 team_1_agent_1=agents[ct][0],
+                 team_1_agent_2=agents[ct][1],
+                 team_1_agent_3=agents[ct][2],
+                 team_1_agent_4=agents[ct][3],
+                 team_1_agent_5=agents[ct][4],
+                 team_2_agent_1=agents[t][0],
+                 team_2_agent_2=agents[t][1],
+                 team_2_agent_3=agents[t][2],
+                 team_2_agent_4=agents[t][3],
+                 team_2_agent_5=agents[t][4])
+    return dict(map=map_name, teams=teams, agents=agent_names, match=match)
+
+
+def parse_tournament(html: str) -> dict[str, list[str]]:
+    """
+    Reads the map, agent and team pools from a tournament's agents page.
+
+    Parameters
+    ----------
+    html : str
+
+    Returns
+    -------
+    dict[str, list[str]]
+        The "maps", "agents" and "teams" in the tournament.
+    """
+
+    soup = BeautifulSoup(html, PARSER, parse_only=TOURNAMENT_PAGE)
+    tables = soup.find_all("table", class_="wf-table")
+    table_1 = tables[0]
+    table_2 = tables[1]
+
+    agents = [agent.img["src"].split("/")[-1].split(".")[0].upper()
+              for agent in table_1.find_all("th", class_="mod-center")]
+
+    maps = [map.text.split("\t")[6].upper()
+            for map in table_1.find_all("tr", class_="pr-global-row")
+            if "mod-all" not in map["class"]]
+
+    teams = [team.find("span", class_="text-of").text.split("\t")[10].upper()
+             for team in table_2.find_all("tr", class_="pr-matrix-row")
+             if "mod-dropdown" not in team["class"]]
+
+    return dict(maps=maps, agents=agents, teams=teams)
+
+
+class Registry:
+    types = {"MAP": "map_pool", "AGENT": "agent_pool", "TEAM": "team_pool"}
+
+    def __init__(self, session: Session):
+        """
+        The tournaments and referalls in the database, loaded once for a scrape and updated as
+        new ones are created. Tournament pools are kept as sets alongside the " - " separated
+        columns.
+
+        Parameters
+        ----------
+        session : Session
+        """
+
+        self.tournaments = {}
+        self.pools = {}
+        self.referalls = dict([(type, set()) for type in self.types])
+        for tournament in session.query(Tournament):
+            self.add_tournament(tournament)
+        for referall in session.query(Referall):
+            self.add_referall(referall)
+
+    def add_tournament(self, tournament: Tournament) -> None:
+        self.tournaments[tournament.tournament] = tournament
+        self.pools[tournament.tournament] = dict(
+            [(type, set(getattr(tournament, column).split(" - ")))
+             for type, column in self.types.items()])
+
+    def add_referall(self, referall: Referall) -> None:
+        self.referalls.setdefault(referall.type, set()).add(referall.name)
+
+    def add_to_pool(self, tournament: str, type: str, name: str) -> bool:
+        """
+        Adds a map, agent or team to a tournament's pool if it isn't already in it.
+
+        Parameters
+        ----------
+        tournament : str
+        type : {"MAP", "AGENT", "TEAM"}
+        name : str
+
+        Returns
+        -------
+        bool
+            Whether the pool was changed.
+        """
+
+        pool = self.pools[tournament][type]
+        if name in pool:
+            return False
+        pool.add(name)
+        tournament_obj = self.tournaments[tournament]
+        column = self.types[type]
+        setattr(tournament_obj, column, getattr(tournament_obj, column) + f" - {name}")
+        return True
 
 
 class VLRScrape:
@@ -20,12 +290,42 @@ class VLRScrape:
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
         "Referer": "http://thewebsite.com",
         "Connection": "keep-alive"}
-    last_scrape = datetime.datetime.now()
+    limiter = RateLimiter(interval=60)
+    cache = ResponseCache()
+    queue_size = 8
+    max_attempts = 3
+    aging = datetime.timedelta(hours=1)
+    backfill_share = 4
 
     def __init__(self, session: Session, tournament_urls: Optional[list[str]] = None,
-                 match_urls: Optional[list[str]] = None):
+                 match_urls: Optional[list[str]] = None, limiter: Optional[RateLimiter] = None,
+                 processes: Optional[int] = None, batch_size: int = 1,
+                 cache: Optional[ResponseCache] = None):
         """
-        Scraper class for obtaining match data from vlr.gg.
+        Scraper class for obtaining match data from vlr.gg. Pages are fetched, parsed and written
+        to the database by separate asyncio stages joined by bounded queues, so parsing and
+        database writes overlap with waiting for the next request. Pages are parsed into plain
+        records by a pool of worker processes. Everything written for a match, including the updates
+        to the Map, Agent, Comp, Team and Tournament tables, is committed in one transaction,
+        optionally grouping several matches per commit. Each match is written in a savepoint, so a
+        match which fails to store is rolled back alone, keeping the rest of the batch.
+
+        Every page is a job in the scrape_jobs table which moves through the pending, fetched,
+        parsed and stored states, keeping the page or its record until it is stored. Unfinished
+        jobs are picked up by the next run, so an interrupted scrape resumes without requesting
+        pages it already has. Jobs which raise an error are marked as failed and retried by later
+        runs up to ``max_attempts`` times. The next job is chosen when a page is requested, by
+        priority: matches from events being watched live, then urls added by hand, then matches
+        from ongoing events and finally backfills of finished events. A job moves up to one
+        priority higher as it waits, reaching it after ``aging``. Every ``backfill_share``-th job a
+        scraper starts is the oldest backfill instead, when one is waiting, so however many urgent
+        jobs keep arriving the backfill still gets at least one job in every ``backfill_share``.
+
+        Fetched pages are kept in a :class:`ResponseCache`, so pages which have not expired are not
+        requested again, and expired pages are requested conditionally. A digest of each event's
+        match list is kept so an event whose matches have not changed adds nothing, and only
+        matches that are not yet known are added as jobs. Completed match pages are archived in
+        the match_pages table, so their matches can be read again by :meth:`reparse`.
 
         Parameters
         ----------
@@ -34,6 +334,16 @@ class VLRScrape:
             List of urls to be scanned.
         match_urls : Optional[list[str]], default None
             List of matches to be scanned.
+        limiter : Optional[RateLimiter], default: None
+            The policy for how often pages are requested. By default every scraper shares one
+            request a minute.
+        processes : Optional[int], default: None
+            The number of worker processes parsing pages, defaults to the number of CPUs.
+        batch_size : int, default: 1
+            The number of matches written in each transaction.
+        cache : Optional[ResponseCache], default: None
+            Where fetched pages are cached. By default every scraper shares a cache in the
+            "VLRCache" directory.
         """
         if tournament_urls is None:
             tournament_urls = []
@@ -41,37 +351,70 @@ class VLRScrape:
             match_urls = []
         self.tournament_urls = tournament_urls
         self.match_urls = []
+        self.added_matches = []
         self.session = session
+        if limiter is not None:
+            self.limiter = limiter
+        if cache is not None:
+            self.cache = cache
+        self.processes = processes
+        self.executor = None
+        self.batch_size = batch_size
+        self.scanned_matches = set()
+        self.stored = []
+        self.ingest = None
+        self.seed = set()
+        self._registry = None
+        self.jobs_started = 0
 
     @property
-    def scanned_matches(self) -> list:
-        try:
-            with open("ScannedMatches.pickle", "rb") as file:
-                matches = pickle.load(file)
-        except FileNotFoundError:
-            with open("ScannedMatches.pickle", "wb"):
-                matches = []
-        return matches
+    def next_request(self) -> datetime.datetime:
+        return self.limiter.next_allowed
+
+    def load_scanned_matches(self) -> set[str]:
+        """
+        Loads the codes of the matches that have already been scanned. Codes from the
+        ScannedMatches.pickle file used by older versions are added to the database the first time.
+
+        Returns
+        -------
+        set[str]
+        """
+
+        codes = set(self.session.scalars(select(ScannedMatch.code)))
+        if not codes and os.path.exists("ScannedMatches.pickle"):
+            try:
+                with open("ScannedMatches.pickle", "rb") as file:
+                    codes = set(pickle.load(file))
+            except EOFError:
+                codes = set()
+            if codes:
+                self.session.execute(insert(ScannedMatch).prefix_with("OR IGNORE"),
+                                     [dict(code=code) for code in codes])
+                self.session.commit()
+        return codes
+
+    @property
+    def registry(self) -> Registry:
+        if self._registry is None:
+            self._registry = Registry(self.session)
+        return self._registry
 
     @property
     def existing_tournaments(self) -> dict:
-        return dict([(tournament.tournament, tournament)
-                     for tournament in self.session.query(Tournament).all()])
+        return self.registry.tournaments
 
     @property
-    def existing_agents(self) -> list:
-        return [referall.name
-                for referall in self.session.query(Referall).where(Referall.type == "AGENT")]
+    def existing_agents(self) -> set:
+        return self.registry.referalls["AGENT"]
 
     @property
-    def existing_maps(self) -> list:
-        return [referall.name
-                for referall in self.session.query(Referall).where(Referall.type == "MAP")]
+    def existing_maps(self) -> set:
+        return self.registry.referalls["MAP"]
 
     @property
-    def existing_teams(self) -> list:
-        return [referall.name
-                for referall in self.session.query(Referall).where(Referall.type == "TEAM")]
+    def existing_teams(self) -> set:
+        return self.registry.referalls["TEAM"]
 
     def add_tournaments(self, tournaments: list | str) -> None:
         if isinstance(tournaments, str):
@@ -81,206 +424,591 @@ class VLRScrape:
 
     def add_matches(self, matches: list | str) -> None:
         if isinstance(matches, str):
-            self.match_urls.append(matches)
-        elif isinstance(matches, list):
+            matches = [matches]
+        if isinstance(matches, list):
             self.match_urls += matches
+            self.added_matches += matches
 
     def find_match_pages(self) -> None:
-        urls = copy.copy(self.tournament_urls)
-        for url in urls:
-            self._find_match_pages(url)
-            self.tournament_urls.remove(url)
+        jobs = self.load_jobs("event", self.tournament_urls)
+        self.tournament_urls = list(dict.fromkeys(self.tournament_urls +
+                                                  [job.url for job in jobs]))
+        try:
+            asyncio.run(self._pipeline("event", parse_match_schedule, self._store_match_pages,
+                                       self.matches_url))
+        finally:
+            self.session.commit()
 
-    def _find_match_pages(self, url: str) -> None:
-        new_url = url.split("/")
-        new_url.insert(4, "matches")
-        matches_url = "/".join(new_url) + "/?series=all"
-        matches_soup = self.scrape(matches_url)
+    def find_match_data(self, priority: Optional[int] = None) -> None:
+        """
+        Scrapes the match jobs.
 
-        matches = matches_soup.find_all("a", class_="match-item")
-        self.match_urls += [self.base + match["href"] for match in matches
-                            if ((match.find("div", class_="match-item-event-series").text.split()[0]
-                                != "Showmatch") and (match.find("div", class_="ml-status").text
-                                == "Completed"))]
+        Parameters
+        ----------
+        priority : Optional[int], default: None
+            Only scrape jobs with this priority or a lower one, such as ``LIVE``. By default every
+            job is scraped.
+        """
 
-    def find_match_data(self) -> None:
-        urls = copy.copy(self.match_urls)
-        for url in urls:
-            scanned = self._find_match_data(url)
-            if scanned:
-                self.match_urls.remove(url)
+        self.scanned_matches = self.load_scanned_matches()
+        self._registry = None
+        jobs = self.load_jobs("match", self.added_matches, priority)
+        self.added_matches = []
+        self.match_urls = list(dict.fromkeys(self.match_urls + [job.url for job in jobs]))
+        codes = set()
+        for job in jobs:
+            code = job.url.split("/")[3]
+            if code in self.scanned_matches or code in codes:
+                print("Match already scanned.")
+                self._set_job(job.url, state="stored", error=None, html=None, record=None)
+                self.match_urls.remove(job.url)
+            else:
+                codes.add(code)
+        self.ingest = Ingest(self.session)
+        try:
+            asyncio.run(self._pipeline("match", parse_match, self._store_match_data,
+                                       priority=priority))
+        finally:
+            self.commit()
+            self.ingest = None
 
-    def _find_match_data(self, url: str) -> bool:
-        scanned_matches = self.scanned_matches
-        code = url.split("/")[3]
-        if code not in scanned_matches:
-            soup = self.scrape(url)
-            if soup.find("div", class_="match-header-vs-note").text.split()[0] != "final":
-                print("Match is not completed.")
-                return False
-            maps = [map for map in soup.find_all("div", class_="vm-stats-game")
-                    if map["data-game-id"] != "all"]
-            tournament = soup.find("a", class_="match-header-event").text.split("\t")[6].upper()
-            if tournament not in self.existing_tournaments:
-                self.create_tournament(soup, tournament)
-            for map in maps:
-                self._find_map_data(map, tournament)
-
-            scanned_matches.append(code)
-            with open("ScannedMatches.pickle", "wb") as file:
-                pickle.dump(scanned_matches, file)
-            return True
-        else:
-            print("Match already scanned.")
-            return True
-
-    def _find_map_data(self, soup: ResultSet, tournament) -> None:
-        tournament_obj = self.existing_tournaments[tournament]
-        map_name = soup.find("div", class_="map").text.split("\t")[7].upper()
-        if map_name not in tournament_obj.map_pool:
-            tournament_obj.map_pool += f" - {map_name}"
-            if map_name not in self.existing_maps:
-                self.create_new_map(map_name)
-
-        teams = [team.text.split("\t")[7].upper()
-                 for team in soup.find_all("div", class_="team-name")]
-        for team in teams:
-            if team not in tournament_obj.team_pool:
-                tournament_obj.team_pool += f" - {team}"
-                if team not in self.existing_teams:
-                    self.create_new_team(team)
-
-        half_scores = soup.find_all("span", class_=re.compile("mod-(ct|t)"))[0:4]
-
-        if "mod-ct" in half_scores[0]["class"]:
-            ct, t = 0, 1
-        elif "mod-t" in half_scores[0]["class"]:
-            ct, t = 1, 0
+    def add_jobs(self, kind: str, urls: list[str], priority: int = MANUAL) -> None:
+        """
+        Adds a pending job for each new url. Event pages which were added again are scanned again
+        for new matches, while failed jobs which were added again have their attempts reset. Jobs
+        which were already added with a higher priority are moved up to this priority.
+
+        Parameters
+        ----------
+        kind : str
+            "event" or "match".
+        urls : list[str]
+        priority : int, default: MANUAL
+            One of ``LIVE``, ``MANUAL``, ``RECENT`` or ``BACKFILL``.
+        """
+
+        if not urls:
+            return
+        urls = list(dict.fromkeys(urls))
+        now = datetime.datetime.now()
+        retry = ["stored", "failed"] if kind == "event" else ["failed"]
+        stmt = insert(ScrapeJob)
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=["url"],
+            set_=dict(state="pending", attempts=0, updated=now, error=None),
+            where=or_(*[ScrapeJob.state == state for state in retry])),
+            [dict(url=url, kind=kind, state="pending", attempts=0, created=now, updated=now,
+                  priority=priority) for url in urls])
+        self.raise_priority(urls, priority)
+
+    def raise_priority(self, urls: list[str], priority: int) -> None:
+        """
+        Moves the jobs for the urls which have a lower priority up to this priority. Urls without
+        a job are ignored.
+
+        Parameters
+        ----------
+        urls : list[str]
+        priority : int
+            One of ``LIVE``, ``MANUAL``, ``RECENT`` or ``BACKFILL``.
+        """
+
+        self.session.execute(update(ScrapeJob).where(
+            ScrapeJob.url.in_(urls), func.coalesce(ScrapeJob.priority, BACKFILL) > priority)
+            .values(priority=priority))
+
+    def _unfinished(self, kind: str, priority: Optional[int] = None) -> list:
+        """Conditions for the jobs of a kind which are still to be stored."""
+        conditions = [ScrapeJob.kind == kind,
+                      ScrapeJob.state.in_(["pending", "fetched", "parsed"]) |
+                      ((ScrapeJob.state == "failed") & (ScrapeJob.attempts < self.max_attempts))]
+        if priority is not None:
+            conditions.append(func.coalesce(ScrapeJob.priority, BACKFILL) <= priority)
+        return conditions
+
+    def _urgency(self):
+        """A job's priority, less one for every ``aging`` since it was added, up to one level."""
+        waited = (func.julianday("now", "localtime") - func.julianday(ScrapeJob.created)) * 86400
+        priority = func.coalesce(ScrapeJob.priority, BACKFILL)
+        return func.max(priority - waited / self.aging.total_seconds(), priority - 1)
+
+    def load_jobs(self, kind: str, urls: list[str], priority: Optional[int] = None) -> list[Row]:
+        """
+        Adds jobs for the urls added to the scraper and finds every job of a kind which is still
+        to be stored, including failed jobs with attempts left.
+
+        Parameters
+        ----------
+        kind : str
+            "event" or "match".
+        urls : list[str]
+            The urls added to the scraper, which are given the ``MANUAL`` priority.
+        priority : Optional[int], default: None
+            Only find jobs with this priority or a lower one.
+
+        Returns
+        -------
+        list[Row]
+            The url, state, html and record of each job, most urgent first.
+        """
+
+        self.add_jobs(kind, urls)
+        self.session.commit()
+        return list(self.session.execute(
+            select(ScrapeJob.url, ScrapeJob.state, ScrapeJob.html, ScrapeJob.record)
+            .where(*self._unfinished(kind, priority))
+            .order_by(self._urgency(), ScrapeJob.created)))
+
+    def next_job(self, kind: str, started: set[str],
+                 priority: Optional[int] = None) -> Optional[Row]:
+        """
+        Finds the most urgent job of a kind which is still to be stored, or the oldest backfill
+        job when it is the backfill's turn, every ``backfill_share``-th job started.
+
+        Parameters
+        ----------
+        kind : str
+            "event" or "match".
+        started : set[str]
+            The urls of the jobs already started by this run, which are skipped.
+        priority : Optional[int], default: None
+            Only find jobs with this priority or a lower one.
+
+        Returns
+        -------
+        Optional[Row]
+            The url, state, attempts, html and record of the job, or None if there are no jobs
+            left.
+        """
+
+        jobs = (select(ScrapeJob.url, ScrapeJob.state, ScrapeJob.attempts, ScrapeJob.html,
+                       ScrapeJob.record)
+                .where(*self._unfinished(kind, priority), ScrapeJob.url.not_in(list(started))))
+        if ((priority is None or priority >= BACKFILL)
+                and self.jobs_started % self.backfill_share == self.backfill_share - 1):
+            job = self.session.execute(
+                jobs.where(func.coalesce(ScrapeJob.priority, BACKFILL) == BACKFILL)
+                .order_by(ScrapeJob.created).limit(1)).first()
+            if job is not None:
+                return job
+        return self.session.execute(
+            jobs.order_by(self._urgency(), ScrapeJob.created).limit(1)).first()
+
+    def store_match_list(self, url: str, matches: list[str], priority: int = MANUAL) -> list[str]:
+        """
+        Finishes an event's job, adding jobs for the completed matches it lists which are not yet
+        known, unless the list is the same as last time. Jobs already added for the matches are
+        moved up to the priority.
+
+        Parameters
+        ----------
+        url : str
+            The event's url.
+        matches : list[str]
+            The links to each completed match, relative to vlr.gg.
+        priority : int, default: MANUAL
+            The priority of the matches added.
+
+        Returns
+        -------
+        list[str]
+            The urls of the matches added.
+        """
+
+        digest = hashlib.sha256("\n".join(sorted(matches)).encode()).hexdigest()
+        if digest == self.session.scalar(select(ScrapeJob.digest).where(ScrapeJob.url == url)):
+            print("No new matches.")
+            urls = []
         else:
-            raise ValueError
-        half1 = [int(half_scores[0].text), int(half_scores[2].text)]
-        half2 = [int(half_scores[1].text), int(half_scores[3].text)]
-        scores = [int(score.text) for score in soup.find_all("div", class_=re.compile("score *"))]
-
-        agent_names = [agent.img.attrs["title"].upper()
-                       for agent in soup.find_all("span", class_="mod-agent")]
-        for agent in agent_names:
-            if agent not in tournament_obj.agent_pool:
-                tournament_obj.agent_pool += f" - {agent}"
-                if agent not in self.existing_agents:
-                    self.create_new_agent(agent)
-
-        agents_1 = agent_names[:5]
-        agents_1.sort()
-        agents_2 = agent_names[5:]
-        agents_2.sort()
-        agents = [agents_1, agents_2]
-
-        match = Match(tournament=tournament,
-                      map=map_name,
-                      team_1=teams[ct],
-                      team_2=teams[t],
-                      team_1_score=scores[ct],
-                      team_2_score=scores[t],
-                      team_1_half=half1[ct],
-                      team_2_half=half1[t],
-                      team_1_half_2=half2[ct],
-                      team_2_half_2=half2[t],
-                      team_1_agent_1=agents[ct][0],
-                      team_1_agent_2=agents[ct][1],
-                      team_1_agent_3=agents[ct][2],
-                      team_1_agent_4=agents[ct][3],
-                      team_1_agent_5=agents[ct][4],
-                      team_2_agent_1=agents[t][0],
-                      team_2_agent_2=agents[t][1],
-                      team_2_agent_3=agents[t][2],
-                      team_2_agent_4=agents[t][3],
-                      team_2_agent_5=agents[t][4])
-
-        self.session.add(match)
+            urls = self.unseen_matches([self.base + match for match in matches])
+            self.add_jobs("match", urls, priority)
+        self.raise_priority([self.base + match for match in matches], priority)
+        self._set_job(url, state="stored", error=None, html=None, record=None, digest=digest)
         self.session.commit()
+        return urls
 
-    def create_tournament(self, soup: ResultSet, tournament: str) -> None:
-        tournament_link = soup.find("a", class_="match-header-event")["href"].split("/")[:3]
-        tournament_link.insert(2, "agents")
-        url = self.base + "/".join(tournament_link)
+    def unseen_matches(self, urls: list[str]) -> list[str]:
+        """
+        Finds the matches which have not been scanned and are not already jobs.
 
-        soup = self.scrape(url)
+        Parameters
+        ----------
+        urls : list[str]
 
-        tables = soup.find_all("table", class_="wf-table")
-        table_1 = tables[0]
-        table_2 = tables[1]
+        Returns
+        -------
+        list[str]
+            The urls with a new code, one for each code.
+        """
 
-        agents = [agent.img["src"].split("/")[-1].split(".")[0].upper()
-                  for agent in table_1.find_all("th", class_="mod-center")]
+        codes = {}
+        for url in urls:
+            codes.setdefault(url.split("/")[3], url)
+        scanned = set(self.session.scalars(select(ScannedMatch.code).where(
+            ScannedMatch.code.in_(list(codes)))))
+        jobs = set(self.session.scalars(select(ScrapeJob.url).where(
+            ScrapeJob.url.in_(list(codes.values())))))
+        return [url for code, url in codes.items() if code not in scanned and url not in jobs]
+
+    def _set_job(self, url: str, **values) -> None:
+        self.session.execute(update(ScrapeJob).where(ScrapeJob.url == url).values(
+            updated=datetime.datetime.now(), **values))
+
+    def _fail_job(self, url: str, error: Exception, **values) -> None:
+        print(f"Failed: {url}\n{type(error).__name__}: {error}")
+        self._set_job(url, state="failed", error=f"{type(error).__name__}: {error}", **values)
+
+    def commit(self) -> None:
+        """Commits the matches stored since the last commit, with their aggregate updates."""
+        if self.seed and get_setting("storage", self.session, "dense") == "dense":
+            seed([self.registry.tournaments[tournament] for tournament in self.seed],
+                 self.session)
+        self.seed = set()
+        if self.ingest is not None:
+            self.ingest.flush()
+        self.session.commit()
+        for url, code in self.stored:
+            self.scanned_matches.add(code)
+            self.match_urls.remove(url)
+        self.stored = []
+
+    async def _pipeline(self, kind: str, parse: Callable[[str], Any],
+                        store: Callable[[str, Any, str], Awaitable[None]],
+                        page_url: Optional[Callable[[str], str]] = None,
+                        priority: Optional[int] = None) -> None:
+        """
+        Fetches the page for each job, parses it and stores the result, with each stage running
+        concurrently. The next job is found from :meth:`next_job` each time, so jobs added while
+        the pipeline runs are run in order of priority. Jobs continue from the last state they
+        reached.
 
-        existing_agents = self.existing_agents
-        existing_maps = self.existing_maps
-        existing_teams = self.existing_teams
+        Parameters
+        ----------
+        kind : str
+            The kind of job to be run, "event" or "match".
+        parse : Callable[[str], Any]
+            Reads the html of a page, run in the worker processes.
+        store : Callable[[str, Any, str], Awaitable[None]]
+            Writes a parsed page to the database, given the job's url, the record and the page.
+        page_url : Optional[Callable[[str], str]], default: None
+            Finds the page fetched for a job's url, by default the url itself.
+        priority : Optional[int], default: None
+            Only run jobs with this priority or a lower one.
+        """
 
-        for agent in agents:
-            if agent not in existing_agents:
-                self.create_new_agent(agent)
+        pages = asyncio.Queue(maxsize=self.queue_size)
+        records = asyncio.Queue(maxsize=self.queue_size)
+
+        async def fetch_stage():
+            started = set()
+            while (job := self.next_job(kind, started, priority)) is not None:
+                started.add(job.url)
+                self.jobs_started += 1
+                self._set_job(job.url, attempts=ScrapeJob.attempts + 1)
+                html = job.html
+                if job.state == "parsed":
+                    await pages.put((job.url, html, json.loads(job.record)))
+                    continue
+                if html is None:
+                    try:
+                        html = await self._fetch(job.url if page_url is None
+                                                 else page_url(job.url))
+                    except CacheMiss as error:
+                        print(error)
+                        continue
+                    except requests.RequestException as error:
+                        self._fail_job(job.url, error)
+                        continue
+                    self._set_job(job.url, state="fetched", html=html)
+                await pages.put((job.url, html, None))
+            for _ in parsers:
+                await pages.put(None)
+
+        async def parse_stage():
+            while (page := await pages.get()) is not None:
+                url, html, record = page
+                if record is None:
+                    try:
+                        record = await self._parse(parse, html)
+                    except Exception as error:
+                        self._fail_job(url, error)
+                        continue
+                    self._set_job(url, state="parsed", record=json.dumps(record))
+                await records.put((url, record, html))
+            await records.put(None)
+
+        async def store_stage():
+            finished = 0
+            while finished < len(parsers):
+                record = await records.get()
+                if record is None:
+                    finished += 1
+                else:
+                    await store(*record)
+
+        processes = self.processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(processes) as self.executor:
+            parsers = [parse_stage() for _ in range(processes)]
+            try:
+                await asyncio.gather(fetch_stage(), *parsers, store_stage())
+            finally:
+                self.executor = None
+
+    async def _fetch(self, url: str) -> str:
+        html = self.cache.get(url)
+        if html is not None:
+            print(f"Cached: {url}")
+            return html
+        print(f"Scraping: {url}")
+        await self.limiter.wait_async()
+        html = await asyncio.to_thread(self._request, url)
+        print("Done")
+        return html
+
+    def _request(self, url: str) -> str:
+        page = requests.get(url, headers=self.headers | self.cache.validators(url))
+        if page.status_code == 304:
+            html = self.cache.revalidate(url)
+            if html is None:
+                raise requests.HTTPError(f"{url} was not modified but is no longer cached")
+            return html
+        page.raise_for_status()
+        self.cache.put(url, page.text, page.headers)
+        return page.text
+
+    async def _parse(self, parse: Callable[[str], Any], html: str) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, parse, html)
+
+    def matches_url(self, url: str) -> str:
+        new_url = url.split("/")
+        new_url.insert(4, "matches")
+        return "/".join(new_url) + "/?series=all"
+
+    async def _store_match_pages(self, url: str, schedule: list[dict[str, Any]],
+                                 html: str) -> None:
+        matches = [match for match in schedule if not match["showmatch"]]
+        ongoing = any([match["status"] != "completed" for match in matches])
+        urls = self.store_match_list(url, [match["href"] for match in matches
+                                           if match["status"] == "completed"],
+                                     RECENT if ongoing else BACKFILL)
+        self.match_urls = list(dict.fromkeys(self.match_urls + urls))
+        self.tournament_urls.remove(url)
+
+    async def _store_match_data(self, url: str, record: dict[str, Any], html: str) -> None:
+        code = url.split("/")[3]
+        if code in self.scanned_matches or code in {stored for _, stored in self.stored}:
+            print("Match already scanned.")
+            self._set_job(url, state="stored", error=None, html=None, record=None)
+            return
+        if not record["completed"]:
+            print("Match is not completed.")
+            self._set_job(url, state="pending", html=None, record=None)
+            return
+
+        tournament = record["tournament"]
+        seed = set(self.seed)
+        # Marking the job first also begins the transaction the savepoint is opened in.
+        self._set_job(url, state="stored", error=None, html=None, record=None)
+        try:
+            pools = await self._tournament_pools(record)
+            with self.session.begin_nested():
+                if pools is not None:
+                    self.create_tournament(tournament, pools)
+                for map in record["maps"]:
+                    self._update_pools(map, tournament)
+
+                matches = [Match(tournament=tournament, code=code, **map["match"])
+                           for map in record["maps"]]
+                self.session.add_all(matches)
+                self.session.add(ScannedMatch(code=code))
+                self.session.merge(MatchPage(code=code, url=url, fetched=datetime.datetime.now(),
+                                             html=zlib.compress(html.encode())))
+                self.session.flush()
+                self.ingest.add_all(matches)
+        except Exception as error:
+            self.seed = seed
+            self._registry = None
+            self.ingest.reload()
+            load_keys(self.session.connection())
+            self._fail_job(url, error, html=html)
+            return
+
+        self.stored.append((url, code))
+        if len(self.stored) >= self.batch_size:
+            self.commit()
+
+    async def _tournament_pools(self, record: dict[str, Any]) -> Optional[dict[str, list[str]]]:
+        """Finds the pools of the tournament a match was played in if it does not exist."""
+        if record["tournament"] not in self.existing_tournaments:
+            tournament_link = record["tournament_link"].split("/")[:3]
+            tournament_link.insert(2, "agents")
+            html = await self._fetch(self.base + "/".join(tournament_link))
+            return await self._parse(parse_tournament, html)
+
+    def reparse(self, method: str = "sql") -> None:
+        """
+        Replaces the matches of every archived match page by parsing the page again with the
+        current parser, in parallel, then regenerates the Map, Agent, Comp, Team and MatchAgent
+        tables with :func:`~rebuild.rebuild`. Pages are parsed by the worker processes a chunk at a
+        time. No pages are requested, the cache is read offline. Matches without an archived page
+        are kept, as are the matches of any page that fails to parse or whose tournament has to be
+        created from an agents page that is not cached. All changes are made in a single
+        transaction, apart from the "parallel" method which reads the new matches from the
+        database, so they are committed first.
 
-        maps = [map.text.split("\t")[6].upper()
-                for map in table_1.find_all("tr", class_="pr-global-row")
-                if "mod-all" not in map["class"]]
+        Parameters
+        ----------
+        method : {"sql", "arrays", "parallel"}, default: "sql"
+            The method used to regenerate the tables.
+        """
 
-        for map in maps:
-            if map not in existing_maps:
-                self.create_new_map(map)
+        self._registry = None
+        cache = self.cache
+        self.cache = ResponseCache(cache.directory, cache.ttls, offline=True)
+        try:
+            asyncio.run(self._reparse())
+            self.seed = set()
+            if method == "parallel":
+                self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            self.seed = set()
+            self._registry = None
+            raise
+        finally:
+            self.cache = cache
+        rebuild(self.session, method, self.processes)
+
+    async def _reparse(self) -> None:
+        codes = list(self.session.scalars(select(MatchPage.code).order_by(MatchPage.fetched)))
+        processes = self.processes or os.cpu_count() or 1
+        chunk = self.queue_size * processes
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(processes) as self.executor:
+            try:
+                for start in range(0, len(codes), chunk):
+                    pages = self.session.execute(
+                        select(MatchPage.code, MatchPage.url, MatchPage.html).where(
+                            MatchPage.code.in_(codes[start:start + chunk]))).all()
+                    records = [loop.run_in_executor(self.executor, parse_archived_page, page.html)
+                               for page in pages]
+                    for page, record in zip(pages, records):
+                        try:
+                            record = await record
+                        except Exception as error:
+                            print(f"Failed: {page.url}\n{type(error).__name__}: {error}")
+                            continue
+                        if not record["completed"]:
+                            print(f"Match is not completed: {page.url}")
+                            continue
+                        try:
+                            await self._replace_matches(page.code, record)
+                        except CacheMiss as error:
+                            print(f"Failed: {page.url}\n{type(error).__name__}: {error}")
+                    print(f"Parsed {min(start + chunk, len(codes))} of {len(codes)} pages")
+            finally:
+                self.executor = None
+
+    async def _replace_matches(self, code: str, record: dict[str, Any]) -> None:
+        tournament = record["tournament"]
+        pools = await self._tournament_pools(record)
+        if pools is not None:
+            self.create_tournament(tournament, pools)
+        for map in record["maps"]:
+            self._update_pools(map, tournament)
+        ids = select(Match.id).where(Match.code == code)
+        self.session.execute(delete(MatchAgent).where(MatchAgent.match_id.in_(ids)))
+        self.session.execute(delete(Match).where(Match.code == code))
+        self.session.add_all([Match(tournament=tournament, code=code, **map["match"])
+                              for map in record["maps"]])
+        self.session.flush()
+
+    def _update_pools(self, record: dict[str, Any], tournament: str) -> None:
+        create = dict(MAP=self.create_new_map, AGENT=self.create_new_agent,
+                      TEAM=self.create_new_team)
+        for type, names in [("MAP", [record["map"]]), ("TEAM", record["teams"]),
+                            ("AGENT", record["agents"])]:
+            for name in names:
+                if self.registry.add_to_pool(tournament, type, name):
+                    self.seed.add(tournament)
+                    if name not in self.registry.referalls[type]:
+                        create[type](name)
+
+    def create_tournament(self, tournament: str, pools: dict[str, list[str]]) -> None:
+        for agent in pools["agents"]:
+            if agent not in self.existing_agents:
+                self.create_new_agent(agent)
 
-        teams = [team.find("span", class_="text-of").text.split("\t")[10].upper()
-                 for team in table_2.find_all("tr", class_="pr-matrix-row")
-                 if "mod-dropdown" not in team["class"]]
+        for map in pools["maps"]:
+            if map not in self.existing_maps:
+                self.create_new_map(map)
 
-        for team in teams:
-            if team not in existing_teams:
+        for team in pools["teams"]:
+            if team not in self.existing_teams:
                 self.create_new_team(team)
 
         tournament_obj = Tournament(tournament=tournament,
                                     games=0,
-                                    map_pool=" - ".join(maps),
-                                    agent_pool=" - ".join(agents),
-                                    team_pool=" - ".join(teams))
+                                    map_pool=" - ".join(pools["maps"]),
+                                    agent_pool=" - ".join(pools["agents"]),
+                                    team_pool=" - ".join(pools["teams"]))
         self.session.add(tournament_obj)
-        self.session.commit()
-
-        setup(tournament_obj, self.session)
+        self.registry.add_tournament(tournament_obj)
+        self.session.flush()
+
+        if get_setting("storage", self.session, "dense") == "dense":
+            seed([tournament_obj], self.session)
+
+    def fetch(self, url: str) -> str:
+        """Finds a page from the cache or requests it, waiting for the limiter."""
+        html = self.cache.get(url)
+        if html is None:
+            print(f"Scraping: {url}")
+            self.limiter.wait()
+            html = self._request(url)
+            print("Done")
+        return html
 
     def scrape(self, url: str) -> ResultSet:
-        print(f"Scraping: {url}")
-        while datetime.datetime.now() - self.last_scrape < datetime.timedelta(seconds=60):
-            pass
-        page = requests.get(url, headers=self.headers)
-        soup = BeautifulSoup(page.text, "html")
-        self.update_last_scrape()
-        print("Done")
-        return soup
+        return BeautifulSoup(self.fetch(url), PARSER)
 
-    @classmethod
-    def update_last_scrape(cls) -> None:
-        cls.last_scrape = datetime.datetime.now()
+    def _add_referall(self, referall: Referall) -> None:
+        self.registry.add_referall(referall)
+        if ("Overall" in self.registry.tournaments
+                and self.registry.add_to_pool("Overall", referall.type, referall.name)):
+            self.seed.add("Overall")
 
     def create_new_map(self, map: str) -> None:
         referall = Referall(name=map,
                             abbreviation=map,
                             type="MAP")
         self.session.add(referall)
-        self.session.commit()
+        self._add_referall(referall)
+        self.session.flush()
 
     def create_new_agent(self, agent: str) -> None:
-        ref = input(f"Enter Abbreviation for {agent}: ").upper()
-        referall = Referall(name=agent,
-                            abbreviation=ref,
-                            type="AGENT")
-        self.session.add(referall)
-        self.session.commit()
+        self.create_pending(agent, "AGENT")
 
     def create_new_team(self, team: str) -> None:
-        ref = input(f"Enter Abbreviation for {team}: ").upper()
-        referall = Referall(name=team,
-                            abbreviation=ref,
-                            type="TEAM")
+        self.create_pending(team, "TEAM")
+
+    def create_pending(self, name: str, type: str) -> None:
+        """
+        Adds an agent or team with a provisional abbreviation, recording that the abbreviation
+        still needs to be chosen, so scraping is not held up waiting for input.
+
+        Parameters
+        ----------
+        name : str
+        type : {"AGENT", "TEAM"}
+        """
+
+        abbreviation = provisional_abbreviation(name, self.session)
+        referall = Referall(name=name,
+                            abbreviation=abbreviation,
+                            type=type)
         self.session.add(referall)
-        self.session.commit()
+        self.session.add(PendingReferall(name=name, type=type))
+        self._add_referall(referall)
+        self.session.flush()
+        print(f"Added {type.title()}: {name} as {abbreviation}, its abbreviation can be set later")
@@ -8,9 +8,12 @@ from sqlalchemy import Engine
 from sqlalchemy.orm import sessionmaker
 
 from .gui_viewer import plot
+from .cache import ResponseCache
 from .get_data import VLRScrape
-from .databases import Tournament, Map, Agent, Team, Comp
+from .databases import Tournament, Map, Agent, Team, Comp, PendingReferall
+from .functions import resolve_referalls
 from . import data_refresh
+from .rebuild import refresh_tournament, update_rollups
 
 matplotlib.use("TkAgg")
 
@@ -30,6 +33,8 @@ class HomePage(BasePage):
         ADD DATA Button - Opens the :class:`AddDataPage`.
         VIEW DATA Button - Opens the :class:`GraphPage`.
         REFRESH DATA Button - Refreshes the database.
+        Tournament Option Menu - Selects the tournament to be refreshed.
+        REFRESH TOURNAMENT Button - Refreshes the selected tournament.
         EXIT Button - Closes the program.
         """
         ctk.CTkFrame.__init__(self, parent, *args, **kwargs)
@@ -57,6 +62,17 @@ class HomePage(BasePage):
         button_refresh.configure(height=80, width=300)
         button_refresh.pack(pady=20, padx=20)
 
+        self.tournament = ctk.StringVar()
+        self.tournament_menu = ctk.CTkOptionMenu(frame, values=[], variable=self.tournament)
+        self.tournament_menu.configure(width=300)
+        self.tournament_menu.pack(pady=(20, 0), padx=20)
+        self.update_tournaments()
+
+        button_tournament = ctk.CTkButton(frame, text="REFRESH TOURNAMENT",
+                                          command=self.press_refresh_tournament)
+        button_tournament.configure(height=80, width=300)
+        button_tournament.pack(pady=20, padx=20)
+
         button_exit = ctk.CTkButton(frame, text="EXIT", command=self.quit)
         button_exit.configure(height=80, width=300)
         button_exit.pack(pady=20, padx=20)
@@ -69,18 +85,36 @@ class HomePage(BasePage):
 
         self._update()
 
-    def press_refresh(self):
+    def update_tournaments(self):
+        """Reloads the tournaments in the tournament option menu."""
+        session = sessionmaker(bind=self.controller.engine)()
+        tournaments = [tournament.tournament for tournament in session.query(Tournament).where(
+            Tournament.tournament != "Overall")]
+        session.close()
+        self.tournament_menu.configure(values=tournaments)
+        if self.tournament.get() not in tournaments:
+            self.tournament.set(tournaments[0] if tournaments else "")
+
+    def press_refresh(self, tournament=None):
         """Checks if a refresh is occuring. If one is not then it will be started."""
         if self.refreshing.is_alive():
             self.label.set("Data Refresh Already in Progress: Please Wait")
         else:
             self.label.set("Data Refresh in Progress: Please Wait")
-            self.refreshing = threading.Thread(target=self._refresh)
+            self.refreshing = threading.Thread(target=self._refresh, args=[tournament])
             self.refreshing.start()
 
-    def _refresh(self):
+    def press_refresh_tournament(self):
+        """Starts a refresh of the selected tournament."""
+        if self.tournament.get():
+            self.press_refresh(self.tournament.get())
+
+    def _refresh(self, tournament=None):
         session = sessionmaker(bind=self.controller.engine)()
-        data_refresh(session)
+        if tournament is None:
+            data_refresh(session)
+        else:
+            refresh_tournament(tournament, session)
         session.close()
 
     def data_page(self):
@@ -124,6 +158,8 @@ class AddDataPage(BasePage):
         Enter key will submit the text.
         SCRAPE Button - Begins the scraping of the submitted urls.
         DONE - Returns to the landing page.
+        ABBREVIATIONS - Opens the :class:`ResolvePage`.
+        OFFLINE - Scrapes only from pages that have been cached.
         """
         ctk.CTkFrame.__init__(self, parent, *args, **kwargs)
 
@@ -159,6 +195,18 @@ class AddDataPage(BasePage):
         ctk.CTkLabel(frame, textvariable=self.label_3).grid(row=6, column=0, columnspan=7, pady=10)
         self.label_3.set(f"Loaded Matches: {len(self.controller.scraper.match_urls)}")
 
+        self.label_4 = ctk.StringVar()
+        ctk.CTkLabel(frame, textvariable=self.label_4).grid(row=7, column=0, columnspan=7, pady=10)
+        self.label_4.set("")
+
+        button_resolve = ctk.CTkButton(frame, text="ABBREVIATIONS", command=self.resolve_page)
+        button_resolve.grid(row=8, column=0, columnspan=7, pady=10)
+        button_resolve.configure(height=40, width=350)
+
+        self.offline = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(frame, text="OFFLINE", variable=self.offline).grid(row=9, column=0,
+                                                                           columnspan=7, pady=10)
+
         button_send = ctk.CTkButton(frame, text="ENTER", command=self.enter_data)
         button_send.grid(row=1, column=6, pady=10)
         button_send.configure(height=20, width=50)
@@ -188,6 +236,7 @@ class AddDataPage(BasePage):
         else:
             self.clicked = True
             self.label.set("Scraping in progress")
+            self.controller.scraper.cache = ResponseCache(offline=self.offline.get())
             self.scraping = threading.Thread(target=self._scrape)
             self.scraping.start()
 
@@ -205,17 +254,108 @@ class AddDataPage(BasePage):
             self.label.set("Can not exit, scraping in progress")
         else:
             self.label.set("")
+            self.controller.frames[HomePage].update_tournaments()
             self.controller.show_frame(HomePage)
 
+    def resolve_page(self):
+        """Opens the :class:`ResolvePage` if the scraper is not running."""
+        if self.scraping.is_alive():
+            self.label.set("Can not exit, scraping in progress")
+        else:
+            self.label.set("")
+            self.controller.frames[ResolvePage].load()
+            self.controller.show_frame(ResolvePage)
+
     def _update(self):
         if self.clicked and not self.scraping.is_alive():
             self.label.set("")
             self.clicked = False
         self.label_2.set(f"Loaded Tournaments: {len(self.controller.scraper.tournament_urls)}")
         self.label_3.set(f"Loaded Matches: {len(self.controller.scraper.match_urls)}")
+        if self.scraping.is_alive():
+            next_request = self.controller.scraper.next_request.strftime("%H:%M:%S")
+            self.label_4.set(f"Next Request: {next_request}")
+        else:
+            self.label_4.set("")
         self.after(1000, self._update)
 
 
+class ResolvePage(BasePage):
+    def __init__(self, parent, controller, *args, **kwargs):
+        """
+        This page is used to choose the abbreviations of agents and teams added while scraping.
+
+        Abbreviation Entries - The abbreviation for each new agent or team, starting with the
+        provisional one.
+        SAVE Button - Saves every abbreviation and updates the comps using them.
+        DONE Button - Returns to the add data page.
+        """
+        ctk.CTkFrame.__init__(self, parent, *args, **kwargs)
+
+        self.controller = controller
+        self.entries = {}
+
+        frame = ctk.CTkFrame(self)
+        frame.pack(pady=12, padx=10)
+
+        ctk.CTkLabel(frame, text="New Abbreviations").grid(row=0, column=0, columnspan=2, pady=10)
+
+        self.scroll = ctk.CTkScrollableFrame(frame, height=400, width=500)
+        self.scroll.grid(row=1, column=0, columnspan=2, pady=10)
+
+        button_save = ctk.CTkButton(frame, text="SAVE", command=self.save)
+        button_save.grid(row=2, column=0, pady=10, padx=10)
+        button_save.configure(height=80, width=240)
+
+        button_done = ctk.CTkButton(frame, text="DONE", command=self.exit_page)
+        button_done.grid(row=2, column=1, pady=10, padx=10)
+        button_done.configure(height=80, width=240)
+
+        self.label = ctk.StringVar()
+        ctk.CTkLabel(frame, textvariable=self.label).grid(row=3, column=0, columnspan=2, pady=10)
+        self.label.set("")
+
+    def load(self):
+        """Lists the agents and teams waiting for an abbreviation."""
+        for child in self.scroll.winfo_children():
+            child.destroy()
+        self.entries = {}
+
+        session = sessionmaker(bind=self.controller.engine)()
+        pending = [(referall.name, referall.type, referall.referall_ref.abbreviation)
+                   for referall in session.query(PendingReferall)]
+        session.close()
+
+        for row, (name, type, abbreviation) in enumerate(pending):
+            ctk.CTkLabel(self.scroll, text=f"{type.title()}: {name}").grid(row=row, column=0,
+                                                                         pady=5, padx=10)
+            entry = ctk.CTkEntry(self.scroll)
+            entry.insert(0, abbreviation)
+            entry.grid(row=row, column=1, pady=5, padx=10)
+            self.entries[name] = entry
+        self.label.set("" if pending else "There are no new abbreviations to choose")
+
+    def save(self):
+        """Saves the entered abbreviations."""
+        abbreviations = dict([(name, entry.get().upper()) for name, entry in self.entries.items()
+                              if entry.get()])
+        session = sessionmaker(bind=self.controller.engine)()
+        try:
+            resolve_referalls(abbreviations, session)
+        except ValueError as error:
+            self.label.set(str(error))
+            return
+        finally:
+            session.close()
+        self.load()
+        self.label.set("Abbreviations saved")
+
+    def exit_page(self):
+        """Returns to the add data page."""
+        self.label.set("")
+        self.controller.show_frame(AddDataPage)
+
+
 class GraphPage(BasePage):
 
     def __init__(self, parent, controller, *args, **kwargs):
@@ -246,6 +386,7 @@ class GraphPage(BasePage):
         self.controller = controller
 
         session = sessionmaker(bind=self.controller.engine)()
+        update_rollups(session)
         self.tournaments = [tournament.tournament for tournament in session.query(Tournament).where(
             Tournament.tournament != "Overall")]
         self.maps = [map.map for map in session.query(Map).where(
@@ -312,6 +453,7 @@ class GraphPage(BasePage):
         self.get_split()
 
         session = sessionmaker(bind=self.controller.engine)()
+        update_rollups(session)
         f = plot(self.selected_tournaments, self.selected_maps, self.selected_comps,
                  self.selected_agents, self.selected_teams, self.title.get(), self.x_axis.get(),
                  self.y_axis.get(), self.split.get(), self.count.get(), session)
@@ -560,7 +702,7 @@ class tkinterApp(ctk.CTk):
         container.grid_columnconfigure(0, weight=1)
 
         self.frames = {}
-        for F in (HomePage, AddDataPage, GraphPage):
+        for F in (HomePage, AddDataPage, ResolvePage, GraphPage):
             frame = F(container, self)
             self.frames[F] = frame
             frame.grid(row=0, column=0, sticky="nsew")
@@ -6,7 +6,7 @@ from sqlalchemy.orm import Session
 from typing import Union
 
 from .databases import Tournament, Map, Agent, Comp, Team
-from .functions import divide
+from .functions import divide, fill_pool
 
 
 def get_label(item: Union[Tournament, Map, Agent, Comp, Team],
@@ -188,6 +188,7 @@ def plot(Tournaments: list[str], Maps: list[str], Comps: list[str], Agents: list
     elif focus == "Maps":
         sources = session.query(Map).where((Map.tournament.in_(Tournaments)) &
                                            (Map.map.in_(Maps))).all()
+        sources = fill_pool(sources, Map, Tournaments, Maps, session)
         atts += [["tournament_ref", "games"], "ct_wins", "t_wins"]
         if len(Maps) == 1:
             title = Maps[0]
@@ -203,12 +204,14 @@ def plot(Tournaments: list[str], Maps: list[str], Comps: list[str], Agents: list
             sources = session.query(Agent).where((Agent.tournament.in_(Tournaments)) &
                                                  (Agent.map.in_(Maps)) &
                                                  (Agent.agent.in_(Agents))).all()
+            sources = fill_pool(sources, Agent, Tournaments, Maps, session, Agents)
             if len(Agents) == 1:
                 title = Agents[0]
         elif focus == "Teams":
             sources = session.query(Team).where((Team.tournament.in_(Tournaments)) &
                                                 (Team.map.in_(Maps)) &
                                                 (Team.team.in_(Teams))).all()
+            sources = fill_pool(sources, Team, Tournaments, Maps, session, Teams)
             if len(Teams) == 1:
                 title = Teams[0]
 
@@ -0,0 +1,69 @@
+import asyncio
+import datetime
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, interval: float = 60, burst: int = 1):
+        """
+        Token bucket limiting how often requests are made. A token is added every ``interval``
+        seconds up to a maximum of ``burst`` tokens and each request uses one token. With a burst of
+        1 this is a minimum interval between requests. Waiting requests sleep rather than spin, and
+        each request reserves its token when it starts waiting so requests are made in the order
+        they were queued, from any thread or event loop.
+
+        Parameters
+        ----------
+        interval : float, default: 60
+            Seconds between tokens, must be greater than 0.
+        burst : int, default: 1
+            The maximum number of tokens that can be saved up.
+        """
+
+        if interval <= 0:
+            raise ValueError(f"Interval must be greater than 0: {interval}")
+        self.interval = interval
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until the next request is allowed, without reserving it."""
+        with self.lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) * self.interval)
+
+    @property
+    def next_allowed(self) -> datetime.datetime:
+        """The time the next request is allowed."""
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.delay())
+
+    def reserve(self) -> float:
+        """
+        Takes a token, which may not have been added yet.
+
+        Returns
+        -------
+        float
+            The seconds to wait before the token can be used.
+        """
+
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens * self.interval)
+
+    def wait(self) -> None:
+        """Sleeps until a request is allowed."""
+        time.sleep(self.reserve())
+
+    async def wait_async(self) -> None:
+        """Awaits until a request is allowed."""
+        await asyncio.sleep(self.reserve())
@@ -1,227 +1,252 @@
+from collections import defaultdict
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
 
-from .databases import Agent, Comp, Map, Match, Team, Tournament
-
-
-def new_game_map(match: Match, session: Session) -> None:
-    """
-    Function to Update the Map Table from data in a new Match.
-
-    Parameters
-    ----------
-    match : Match
-        The Match object to update the table from.
-    session : Session
-    """
-
-    specific_map = match.map_ref
-    ovr = session.query(Map).where((Map.tournament == "Overall") &
-                                   (Map.map == "Overall")).first()
-    ovr_map = session.query(Map).where((Map.tournament == "Overall") &
-                                       (Map.map == specific_map.map)).first()
-    ovr_tour = session.query(Map).where((Map.tournament == match.tournament) &
-                                        (Map.map == "Overall")).first()
-
-    maps = [specific_map, ovr, ovr_map, ovr_tour]
-    for map in maps:
-        map.games += 1
-        map.ct_wins += match.team_1_half + match.team_2_half_2
-        map.t_wins += match.team_1_half_2 + match.team_2_half
-
-    session.commit()
-
-
-def new_game_agent(team: list[Agent], result: int, session: Session) -> None:
-    """
-    Function to Update the Agent Table from data in a new Match.
-
-    Paramaters
-    ----------
-    team : list[Agent]
-        The Agents on a given team.
-    result : int
-        Int showing whether the team won.
-    session : Session
-    """
-
-    for agent in team:
-        specific_agent = agent
-        map_agent = session.query(Agent).where((Agent.tournament == "Overall") &
-                                               (Agent.map == agent.map) &
-                                               (Agent.agent == agent.agent)).first()
-        tour_agent = session.query(Agent).where((Agent.tournament == agent.tournament) &
-                                                (Agent.map == "Overall") &
-                                                (Agent.agent == agent.agent)).first()
-        ovr_agent = session.query(Agent).where((Agent.tournament == "Overall") &
-                                               (Agent.map == "Overall") &
-                                               (Agent.agent == agent.agent)).first()
-        agents = [specific_agent, map_agent, tour_agent, ovr_agent]
-        for agent_ in agents:
-            agent_.games += 1
-            agent_.wins += result
-
-
-def new_game_comp(match: Match, result: int, session: Session) -> None:
-    """
-    Function to Update the Comp Table from data in a new Match.
-
-    Parameters
-    ----------
-    match : Match
-        The match object for the new match.
-    result : int
-        Int showing which team won.
-    session : Session
-    """
-
-    team_1 = [[match.team_1_agent_1_ref,
-               match.team_1_agent_2_ref,
-               match.team_1_agent_3_ref,
-               match.team_1_agent_4_ref,
-               match.team_1_agent_5_ref],
-              [match.team_1_comp_ref,
-               "{} {} {} {} {}".format(
-                   match.team_1_agent_1_ref.agent_ref.abbreviation,
-                   match.team_1_agent_2_ref.agent_ref.abbreviation,
-                   match.team_1_agent_3_ref.agent_ref.abbreviation,
-                   match.team_1_agent_4_ref.agent_ref.abbreviation,
-                   match.team_1_agent_5_ref.agent_ref.abbreviation)]]
-
-    team_2 = [[match.team_2_agent_1_ref,
-               match.team_2_agent_2_ref,
-               match.team_2_agent_3_ref,
-               match.team_2_agent_4_ref,
-               match.team_2_agent_5_ref],
-              [match.team_2_comp_ref,
-               "{} {} {} {} {}".format(
-                   match.team_2_agent_1_ref.agent_ref.abbreviation,
-                   match.team_2_agent_2_ref.agent_ref.abbreviation,
-                   match.team_2_agent_3_ref.agent_ref.abbreviation,
-                   match.team_2_agent_4_ref.agent_ref.abbreviation,
-                   match.team_2_agent_5_ref.agent_ref.abbreviation)]]
-
-    teams = [team_1, team_2]
-
-    for team in teams:
-        comp = session.query(Comp).where((Comp.tournament == match.tournament) &
-                                         (Comp.map == match.map) &
-                                         (Comp.agent_1 == team[0][0].agent) &
-                                         (Comp.agent_2 == team[0][1].agent) &
-                                         (Comp.agent_3 == team[0][2].agent) &
-                                         (Comp.agent_4 == team[0][3].agent) &
-                                         (Comp.agent_5 == team[0][4].agent)).first()
-
-        map_comp = session.query(Comp).where((Comp.tournament == "Overall") &
-                                             (Comp.map == match.map) &
-                                             (Comp.agent_1 == team[0][0].agent) &
-                                             (Comp.agent_2 == team[0][1].agent) &
-                                             (Comp.agent_3 == team[0][2].agent) &
-                                             (Comp.agent_4 == team[0][3].agent) &
-                                             (Comp.agent_5 == team[0][4].agent)).first()
-
-        tour_comp = session.query(Comp).where((Comp.tournament == match.tournament) &
-                                              (Comp.map == "Overall") &
-                                              (Comp.agent_1 == team[0][0].agent) &
-                                              (Comp.agent_2 == team[0][1].agent) &
-                                              (Comp.agent_3 == team[0][2].agent) &
-                                              (Comp.agent_4 == team[0][3].agent) &
-                                              (Comp.agent_5 == team[0][4].agent)).first()
-
-        ovr_comp = session.query(Comp).where((Comp.tournament == "Overall") &
-                                             (Comp.map == "Overall") &
-                                             (Comp.agent_1 == team[0][0].agent) &
-                                             (Comp.agent_2 == team[0][1].agent) &
-                                             (Comp.agent_3 == team[0][2].agent) &
-                                             (Comp.agent_4 == team[0][3].agent) &
-                                             (Comp.agent_5 == team[0][4].agent)).first()
-        comps = [[ovr_comp, map_comp, tour_comp, comp],
-                 [["Overall", "Overall"],
-                  ["Overall", match.map],
-                  [match.tournament, "Overall"],
-                  [match.tournament, match.map]]]
-
-        for n, comp_ in enumerate(comps[0]):
-            if comp_:
-                comp_.games += 1
-                comp_.wins += result
-            else:
-                new_comp = Comp(tournament=comps[1][n][0],
-                                map=comps[1][n][1],
-                                agent_1=team[0][0].agent,
-                                agent_2=team[0][1].agent,
-                                agent_3=team[0][2].agent,
-                                agent_4=team[0][3].agent,
-                                agent_5=team[0][4].agent,
-                                games=1,
-                                wins=result,
-                                ref=team[1][1])
-                session.add(new_comp)
-
-        if not team[1][0]:
-            team[1][0] = comp
-
-        new_game_agent(team[0], result, session)
-
-        result = (result + 1) % 2
-
-        session.commit()
-
-
-def new_game_team(match: Match, result: int, session: Session) -> Session:
-    """
-    Function to Update the Team table from data in a new Match.
-
-    Parameters
-    ----------
-    match : Match
-        The Match object of the new match.
-    result : int
-        Int showing which team won the match.
-    session : Session
-    """
-
-    teams = [match.team_1_ref,
-             match.team_2_ref]
-
-    for team in teams:
-        specific_team = team
-        map_team = session.query(Team).where((Team.tournament == "Overall") &
-                                             (Team.map == team.map) &
-                                             (Team.team == team.team)).first()
-        tour_team = session.query(Team).where((Team.tournament == team.tournament) &
-                                              (Team.map == "Overall") &
-                                              (Team.team == team.team)).first()
-        ovr_team = session.query(Team).where((Team.tournament == "Overall") &
-                                             (Team.map == "Overall") &
-                                             (Team.team == team.team)).first()
-        teams_ = [specific_team, map_team, tour_team, ovr_team]
-        for team_ in teams_:
-            team_.games += 1
-            team_.wins += result
-
-        result = (result + 1) % 2
-
-    session.commit()
-
-
-def new_game_tournament(match: Match, session) -> Session:
-    """
-    Function to update the Tournament table with data from a new Match.
-
-    Parameters
-    ----------
-    match : Match
-        The Match object for the new Match.
-    session : Session
-    """
-
-    ovr = session.query(Tournament).where(Tournament.tournament == "Overall").first()
-    ovr.games += 1
-    match.tournament_ref.games += 1
-    session.commit()
-
-
-def new_game(match: Match, result: int, session: Session) -> Session:
+from .databases import Agent, Comp, Map, Match, MatchAgent, Team, Tournament, Referall
+from .functions import agent_bits, assign_ids, comp_mask, get_setting, set_setting
+
+
+class Ingest:
+    def __init__(self, session: Session):
+        """
+        Context for adding new matches to the Map, Agent, Comp, Team, Tournament and MatchAgent
+        tables in a batch. Counter increments for every (tournament, map, key) row, including the
+        "Overall" rollups, are kept in memory and written with one upsert per table when the batch
+        is flushed. When the database's rollups are found on read only the (tournament, map) rows
+        are updated and the rollups are marked as out of date.
+
+        Parameters
+        ----------
+        session : Session
+        """
+
+        self.session = session
+        self.reload()
+        self.leaf_only = get_setting("rollups", session, "stored") == "read"
+        self.clear()
+
+    def __enter__(self) -> "Ingest":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+            self.session.commit()
+
+    def clear(self) -> None:
+        """Discards any increments that have not been flushed."""
+        self.tournaments = defaultdict(int)
+        self.maps = defaultdict(lambda: [0, 0, 0])
+        self.agents = defaultdict(lambda: [0, 0])
+        self.teams = defaultdict(lambda: [0, 0])
+        self.comps = defaultdict(lambda: [0, 0])
+        self.match_agents = []
+
+    def reload(self) -> None:
+        """Discards the cached abbreviations, agent bits and ids, such as after a rollback."""
+        self.abbreviations = None
+        self.bits = {}
+        self.ids = {Tournament: {}, Referall: {}}
+
+    def abbreviation(self, name: str) -> str:
+        """
+        Finds the abbreviation of an agent or team, reloading the abbreviations if it is new.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        str
+            The abbreviation, or the name itself if it has none.
+        """
+
+        if self.abbreviations is None or name not in self.abbreviations:
+            self.abbreviations = dict([(referall.name, referall.abbreviation)
+                                       for referall in self.session.query(Referall)])
+        return self.abbreviations.get(name, name)
+
+    def mask(self, agents: list[str]) -> int:
+        """
+        Finds the bitmask of a comp, reloading the agent bits if an agent is new.
+
+        Parameters
+        ----------
+        agents : list[str]
+
+        Returns
+        -------
+        int
+            The comp's mask from :func:`~functions.comp_mask`.
+        """
+
+        if any([agent not in self.bits for agent in agents]):
+            self.bits = agent_bits(self.session)
+        return comp_mask(agents, self.bits)
+
+    def id(self, table: type[Tournament | Referall], name: str) -> int:
+        """
+        Finds the integer id of a tournament or referall, assigning ids if it is new.
+
+        Parameters
+        ----------
+        table : type[Tournament | Referall]
+        name : str
+
+        Returns
+        -------
+        int
+        """
+
+        if name not in self.ids[table]:
+            self.ids[table] = assign_ids(table, self.session)
+        return self.ids[table][name]
+
+    def add(self, match: Match, result: int = None) -> None:
+        """
+        Adds the increments from a new match to the batch.
+
+        Parameters
+        ----------
+        match : Match
+            The Match object to update the tables from.
+        result : int, default: None
+            Int showing whether team 1 won. Found from the scores if not given.
+        """
+
+        self._apply(self._prepare(match, result))
+
+    def add_all(self, matches: list[Match]) -> None:
+        """
+        Adds the increments from several new matches to the batch, such as the maps of a series.
+        Every lookup is made before any increment, so if one fails none of the matches are added.
+
+        Parameters
+        ----------
+        matches : list[Match]
+            The Match objects to update the tables from, with the results found from the scores.
+        """
+
+        for prepared in [self._prepare(match) for match in matches]:
+            self._apply(prepared)
+
+    def _prepare(self, match: Match, result: int = None) -> tuple:
+        """Makes every lookup needed to add a match, without changing the batch."""
+        if result is None:
+            result = int(match.team_1_score > match.team_2_score)
+
+        team_1 = [match.team_1_agent_1, match.team_1_agent_2, match.team_1_agent_3,
+                  match.team_1_agent_4, match.team_1_agent_5]
+        team_2 = [match.team_2_agent_1, match.team_2_agent_2, match.team_2_agent_3,
+                  match.team_2_agent_4, match.team_2_agent_5]
+        sides = [(match.team_1, team_1, result), (match.team_2, team_2, (result + 1) % 2)]
+        match.team_1_mask = self.mask(team_1)
+        match.team_2_mask = self.mask(team_2)
+
+        if match.id is None:
+            self.session.flush()
+        match_agents = []
+        for side, (team, agents, won) in enumerate(sides, 1):
+            for slot, agent in enumerate(agents, 1):
+                match_agents.append(dict(match_id=match.id, side=side, slot=slot,
+                                         tournament=self.id(Tournament, match.tournament),
+                                         map=self.id(Referall, match.map),
+                                         agent=self.id(Referall, agent),
+                                         team=self.id(Referall, team), won=bool(won)))
+
+        ct_wins = match.team_1_half + match.team_2_half_2
+        t_wins = match.team_1_half_2 + match.team_2_half
+        return match, sides, match_agents, ct_wins, t_wins
+
+    def _apply(self, prepared: tuple) -> None:
+        """Adds the increments of a match from :meth:`_prepare` to the batch."""
+        match, sides, match_agents, ct_wins, t_wins = prepared
+        self.tournaments[match.tournament] += 1
+        self.tournaments["Overall"] += 1
+        self.match_agents += match_agents
+
+        groups = [(match.tournament, match.map)]
+        if not self.leaf_only:
+            groups += [(match.tournament, "Overall"), ("Overall", match.map),
+                       ("Overall", "Overall")]
+
+        for tournament, map in groups:
+            map_ = self.maps[(tournament, map)]
+            map_[0] += 1
+            map_[1] += ct_wins
+            map_[2] += t_wins
+
+            for team, agents, won in sides:
+                team_ = self.teams[(tournament, map, team)]
+                team_[0] += 1
+                team_[1] += won
+
+                comp = self.comps[(tournament, map, *agents)]
+                comp[0] += 1
+                comp[1] += won
+
+                for agent in agents:
+                    agent_ = self.agents[(tournament, map, agent)]
+                    agent_[0] += 1
+                    agent_[1] += won
+
+    def flush(self) -> None:
+        """Writes the batched increments to the database."""
+
+        if self.leaf_only and self.maps:
+            set_setting("rollups_stale", "1", self.session)
+        self.session.flush()
+        if self.tournaments:
+            table = Tournament.__table__
+            self.session.execute(
+                update(table).where(table.c.tournament == bindparam("name")).values(
+                    games=table.c.games + bindparam("count")),
+                [dict(name=tournament, count=count)
+                 for tournament, count in self.tournaments.items()])
+
+        if self.maps:
+            stmt = insert(Map)
+            self.session.execute(stmt.on_conflict_do_update(
+                index_elements=["tournament", "map"],
+                set_=dict(games=Map.games + stmt.excluded.games,
+                          ct_wins=Map.ct_wins + stmt.excluded.ct_wins,
+                          t_wins=Map.t_wins + stmt.excluded.t_wins)),
+                [dict(tournament=tournament, map=map, games=games, ct_wins=ct_wins, t_wins=t_wins)
+                 for (tournament, map), (games, ct_wins, t_wins) in self.maps.items()])
+
+        for table, key, rows in [(Agent, "agent", self.agents), (Team, "team", self.teams)]:
+            if rows:
+                stmt = insert(table)
+                self.session.execute(stmt.on_conflict_do_update(
+                    index_elements=["tournament", "map", key],
+                    set_=dict(games=table.games + stmt.excluded.games,
+                              wins=table.wins + stmt.excluded.wins)),
+                    [{"tournament": tournament, "map": map, key: name,
+                      "games": games, "wins": wins}
+                     for (tournament, map, name), (games, wins) in rows.items()])
+
+        if self.comps:
+            stmt = insert(Comp)
+            self.session.execute(stmt.on_conflict_do_update(
+                index_elements=["tournament", "map", "mask"],
+                set_=dict(games=Comp.games + stmt.excluded.games,
+                          wins=Comp.wins + stmt.excluded.wins)),
+                [dict(tournament=tournament, map=map, agent_1=agents[0], agent_2=agents[1],
+                      agent_3=agents[2], agent_4=agents[3], agent_5=agents[4], games=games,
+                      wins=wins, ref=" ".join([self.abbreviation(agent) for agent in agents]),
+                      mask=self.mask(agents))
+                 for (tournament, map, *agents), (games, wins) in self.comps.items()])
+
+        if self.match_agents:
+            self.session.execute(insert(MatchAgent).prefix_with("OR REPLACE"), self.match_agents)
+
+        self.session.expire_all()
+        self.clear()
+
+
+def new_game(match: Match, result: int, session: Session) -> None:
     """Hub Function to update the database based on a new match.
 
     Parameters
@@ -233,7 +258,5 @@ def new_game(match: Match, result: int, session: Session) -> Session:
     session : Session
     """
 
-    new_game_tournament(match, session)
-    new_game_map(match, session)
-    new_game_comp(match, result, session)
-    new_game_team(match, result, session)
+    with Ingest(session) as ingest:
+        ingest.add(match, result)
@@ -0,0 +1,426 @@
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+from .databases import Tournament, Map, Agent, Comp, Team, Match, Referall, Key
+from .functions import (get_setting, set_setting, agent_bits, assign_ids, encode_keys,
+                        key_columns, match_agents_sql, MASK_SQL, MATCH_AGENTS_SQL)
+from .new_game import Ingest
+from .arrays import MatchArrays, merge, parallel_totals
+
+ROLLUPS = [("tournament", "map"),
+           ("tournament", "'Overall'"),
+           ("'Overall'", "map"),
+           ("'Overall'", "'Overall'")]
+
+AGENT_PICKS = "\nUNION ALL\n".join(
+    [f"SELECT tournament, map, team_{team}_agent_{n} AS agent, {won} AS won FROM matches"
+     for team, won in [(1, "team_1_score > team_2_score"), (2, "team_1_score <= team_2_score")]
+     for n in range(1, 6)])
+
+TEAM_PICKS = """SELECT tournament, map, team_1 AS team, team_1_score > team_2_score AS won
+FROM matches
+UNION ALL
+SELECT tournament, map, team_2 AS team, team_1_score <= team_2_score AS won FROM matches"""
+
+COMP_PICKS = "\nUNION ALL\n".join(
+    [f"SELECT tournament, map, team_{team}_agent_1 AS agent_1, team_{team}_agent_2 AS agent_2, "
+     f"team_{team}_agent_3 AS agent_3, team_{team}_agent_4 AS agent_4, "
+     f"team_{team}_agent_5 AS agent_5, {won} AS won FROM matches"
+     for team, won in [(1, "team_1_score > team_2_score"), (2, "team_1_score <= team_2_score")]])
+
+
+def rollup(select: str, keys: str, groups: list[tuple[str, str]] = ROLLUPS) -> str:
+    """
+    Repeats a grouped select for the leaf rows and each of the "Overall" rollups.
+
+    Parameters
+    ----------
+    select : str
+        The select statement, with ``{tournament}`` and ``{map}`` placeholders for the grouping
+        columns.
+    keys : str
+        The remaining grouping columns.
+    groups : list[tuple[str, str]], default: ROLLUPS
+        The tournament and map grouping columns of each select.
+
+    Returns
+    -------
+    str
+        The union of the four grouped selects.
+    """
+
+    return "\nUNION ALL\n".join(
+        [select.format(tournament=tournament, map=map) +
+         f"\nWHERE true GROUP BY {tournament}, {map}" + (f", {keys}" if keys else "")
+         for tournament, map in groups])
+
+
+MAP_SQL = """INSERT INTO maps (tournament, map, games, ct_wins, t_wins)
+{select}
+ON CONFLICT (tournament, map) DO UPDATE SET
+games = games + excluded.games,
+ct_wins = ct_wins + excluded.ct_wins,
+t_wins = t_wins + excluded.t_wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, COUNT(*), SUM(team_1_half + team_2_half_2), "
+    "SUM(team_1_half_2 + team_2_half) FROM matches", ""))
+
+AGENT_SQL = """INSERT INTO agents (tournament, map, agent, games, wins)
+{select}
+ON CONFLICT (tournament, map, agent) DO UPDATE SET
+games = games + excluded.games,
+wins = wins + excluded.wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, agent, COUNT(*), SUM(won) FROM (" + AGENT_PICKS + ")",
+    "agent"))
+
+TEAM_SQL = """INSERT INTO teams (tournament, map, team, games, wins)
+{select}
+ON CONFLICT (tournament, map, team) DO UPDATE SET
+games = games + excluded.games,
+wins = wins + excluded.wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, team, COUNT(*), SUM(won) FROM (" + TEAM_PICKS + ")",
+    "team"))
+
+COMP_SQL = """INSERT INTO comps (tournament, map, agent_1, agent_2, agent_3, agent_4, agent_5,
+                   games, wins, ref, mask)
+{select}""".format(select=rollup(
+    "SELECT {tournament}, {map}, agent_1, agent_2, agent_3, agent_4, agent_5, COUNT(*), "
+    "SUM(won), " + " || ' ' || ".join([f"COALESCE(ref_{n}.abbreviation, agent_{n})"
+                                        for n in range(1, 6)]) +
+    ", " + " | ".join([f"(1 << ref_{n}.bit)" for n in range(1, 6)]) +
+    " FROM (" + COMP_PICKS + ") AS picks" +
+    "".join([f"\nLEFT JOIN referall AS ref_{n} ON ref_{n}.{{{{referall}}}} = agent_{n}"
+             for n in range(1, 6)]),
+    "agent_1, agent_2, agent_3, agent_4, agent_5"))
+
+LEAF = "(SELECT * FROM {table} WHERE tournament != 'Overall' AND map != 'Overall')"
+
+MAP_ROLLUP_SQL = """INSERT INTO maps (tournament, map, games, ct_wins, t_wins)
+{select}
+ON CONFLICT (tournament, map) DO UPDATE SET
+games = games + excluded.games,
+ct_wins = ct_wins + excluded.ct_wins,
+t_wins = t_wins + excluded.t_wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, SUM(games), SUM(ct_wins), SUM(t_wins) FROM " +
+    LEAF.format(table="maps"), "", ROLLUPS[1:]))
+
+AGENT_ROLLUP_SQL = """INSERT INTO agents (tournament, map, agent, games, wins)
+{select}
+ON CONFLICT (tournament, map, agent) DO UPDATE SET
+games = games + excluded.games,
+wins = wins + excluded.wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, agent, SUM(games), SUM(wins) FROM " +
+    LEAF.format(table="agents"), "agent", ROLLUPS[1:]))
+
+TEAM_ROLLUP_SQL = """INSERT INTO teams (tournament, map, team, games, wins)
+{select}
+ON CONFLICT (tournament, map, team) DO UPDATE SET
+games = games + excluded.games,
+wins = wins + excluded.wins""".format(select=rollup(
+    "SELECT {tournament}, {map}, team, SUM(games), SUM(wins) FROM " +
+    LEAF.format(table="teams"), "team", ROLLUPS[1:]))
+
+COMP_ROLLUP_SQL = """INSERT INTO comps (tournament, map, agent_1, agent_2, agent_3, agent_4,
+                   agent_5, games, wins, ref, mask)
+{select}""".format(select=rollup(
+    "SELECT {tournament}, {map}, MAX(agent_1), MAX(agent_2), MAX(agent_3), MAX(agent_4), "
+    "MAX(agent_5), SUM(games), SUM(wins), MAX(ref), mask FROM " + LEAF.format(table="comps"),
+    "mask", ROLLUPS[1:]))
+
+
+def seed(tournaments: list[Tournament], session: Session) -> None:
+    """
+    Creates the empty rows for every tournament in bulk, equivalent to calling
+    :func:`~functions.setup` on each tournament without committing.
+
+    Parameters
+    ----------
+    tournaments : list[Tournament]
+    session : Session
+    """
+
+    maps, agents, teams = [], [], []
+    for tournament in tournaments:
+        map_pool = ["Overall"] + tournament.map_pool.split(" - ")
+        agent_pool = tournament.agent_pool.split(" - ")
+        team_pool = tournament.team_pool.split(" - ")
+        for map in map_pool:
+            maps.append(dict(tournament=tournament.tournament, map=map,
+                             games=0, ct_wins=0, t_wins=0))
+            agents += [dict(tournament=tournament.tournament, map=map, agent=agent,
+                            games=0, wins=0) for agent in agent_pool]
+            teams += [dict(tournament=tournament.tournament, map=map, team=team,
+                           games=0, wins=0) for team in team_pool]
+
+    for table, rows in [(Map, maps), (Agent, agents), (Team, teams)]:
+        if rows:
+            session.execute(insert(table).prefix_with("OR IGNORE"), rows)
+
+
+def reset(session: Session) -> None:
+    """
+    Empties the Map, Agent, Comp, Team and MatchAgent tables, resets the games played in each
+    tournament and creates the empty rows in the "dense" storage mode. Nothing is committed.
+
+    Parameters
+    ----------
+    session : Session
+    """
+
+    for table in ["match_agents", "comps", "agents", "teams", "maps"]:
+        session.execute(text(f"DELETE FROM {table}"))
+
+    overall = session.query(Tournament).where(Tournament.tournament == "Overall").first()
+    if overall:
+        for type, pool in [("MAP", "map_pool"), ("AGENT", "agent_pool"), ("TEAM", "team_pool")]:
+            setattr(overall, pool, " - ".join([referall.name for referall in session.query(
+                Referall).where(Referall.type == type)]))
+    session.flush()
+    session.execute(text("UPDATE tournaments SET games = 0"))
+
+    if get_setting("storage", session, "dense") == "dense":
+        seed(session.query(Tournament).all(), session)
+
+
+def rebuild(session: Session, method: str = "sql", processes: int = None) -> None:
+    """
+    Regenerates the Map, Agent, Comp, Team and MatchAgent tables directly from the matches table.
+    All changes are made in a single transaction. Empty rows for the tournament pools are only
+    created in the "dense" storage mode.
+
+    Parameters
+    ----------
+    session : Session
+    method : {"sql", "arrays", "parallel"}, default: "sql"
+        "sql" uses grouped ``INSERT ... SELECT`` statements. "arrays" loads the matches into a
+        :class:`~arrays.MatchArrays` and sums them with numpy. "parallel" sums each tournament's
+        matches in a separate process, before the tables are cleared, and merges the results.
+    processes : int, default: None
+        The number of worker processes for the "parallel" method, defaults to the number of CPUs.
+    """
+
+    if method not in ["sql", "arrays", "parallel"]:
+        raise ValueError(f"Unknown rebuild method: {method}")
+
+    if method == "parallel":
+        partitions = parallel_totals(session, processes)
+
+    try:
+        reset(session)
+        assign_ids(Tournament, session)
+        assign_ids(Referall, session)
+        agent_bits(session)
+        keys = key_columns(session)
+        session.execute(text(MASK_SQL.format(**keys)))
+        session.execute(text(MATCH_AGENTS_SQL.format(**keys)))
+        if method == "sql":
+            session.execute(text("UPDATE tournaments SET games = (SELECT COUNT(*) FROM matches "
+                                 "WHERE matches.tournament = tournaments.{tournaments})".format(
+                                     **keys)))
+            session.execute(text("UPDATE tournaments SET games = (SELECT COUNT(*) FROM matches) "
+                                 "WHERE tournament = 'Overall'"))
+            for sql in [MAP_SQL, AGENT_SQL, TEAM_SQL, COMP_SQL]:
+                session.execute(text(sql.format(**keys)))
+        elif method == "arrays":
+            ingest = Ingest(session)
+            MatchArrays(session).fill(ingest)
+            ingest.flush()
+        elif method == "parallel":
+            ingest = Ingest(session)
+            for totals in partitions:
+                merge(ingest, totals)
+            ingest.flush()
+        set_setting("rollups_stale", "0", session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def refresh_tournament(name: str, session: Session) -> None:
+    """
+    Regenerates the rows of a single tournament from its matches. The tournament's rows are
+    replaced and the "Overall" rows are adjusted by the difference in its (tournament, map) rows,
+    so only that tournament's matches and rows are read. All changes are made in a single
+    transaction.
+
+    Parameters
+    ----------
+    name : str
+        The name of the tournament.
+    session : Session
+    """
+
+    tournament = session.query(Tournament).where(Tournament.tournament == name).first()
+    if tournament is None or name == "Overall":
+        raise ValueError(f"Unknown tournament: {name}")
+
+    try:
+        ids = assign_ids(Tournament, session)
+        assign_ids(Referall, session)
+        agent_bits(session)
+        keys = key_columns(session)
+        session.execute(text(MASK_SQL.format(**keys) + " WHERE tournament = (SELECT {tournaments} "
+                             "FROM tournaments WHERE tournament = :name)".format(**keys)),
+                        dict(name=name))
+        session.execute(text("DELETE FROM match_agents WHERE tournament = :id"), dict(id=ids[name]))
+        session.execute(text(match_agents_sql("tournaments.tournament = :name").format(**keys)),
+                        dict(name=name))
+
+        ingest = Ingest(session)
+        old = dict(tournaments={name: -tournament.games}, maps={}, agents={}, teams={}, comps={})
+        for table, rows, keys, counts in [
+                (Map, old["maps"], [], ["games", "ct_wins", "t_wins"]),
+                (Agent, old["agents"], ["agent"], ["games", "wins"]),
+                (Team, old["teams"], ["team"], ["games", "wins"]),
+                (Comp, old["comps"], [f"agent_{n}" for n in range(1, 6)], ["games", "wins"])]:
+            for row in session.query(table).where(table.tournament == name, table.games > 0):
+                groups = [(name, row.map)]
+                if row.map != "Overall":
+                    groups += [("Overall", row.map), ("Overall", "Overall")]
+                for group in groups:
+                    key = group + tuple(getattr(row, column) for column in keys)
+                    values = rows.setdefault(key, [0] * len(counts))
+                    for i, count in enumerate(counts):
+                        values[i] -= getattr(row, count)
+        old["tournaments"]["Overall"] = -tournament.games
+        merge(ingest, old)
+        merge(ingest, MatchArrays(session, name).totals())
+        ingest.flush()
+
+        session.execute(text("DELETE FROM comps WHERE games = 0"))
+        if get_setting("storage", session, "dense") == "sparse":
+            for table in ["maps", "agents", "teams"]:
+                session.execute(text(f"DELETE FROM {table} WHERE games = 0"))
+        else:
+            seed([tournament], session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def set_storage(mode: str, session: Session) -> None:
+    """
+    Changes how the aggregate tables are stored and rebuilds them to match.
+
+    Parameters
+    ----------
+    mode : {"dense", "sparse"}
+        "dense" stores a row for every map, agent and team in a tournament's pools. "sparse" only
+        stores rows that have been played, the empty rows are then added when read by
+        :func:`~functions.fill_pool`.
+    session : Session
+    """
+
+    if mode not in ["dense", "sparse"]:
+        raise ValueError(f"Unknown storage mode: {mode}")
+    set_setting("storage", mode, session)
+    rebuild(session)
+
+
+def update_rollups(session: Session, force: bool = False) -> None:
+    """
+    Recalculates the "Overall" rows of the Map, Agent, Comp and Team tables from the
+    (tournament, map) rows, if they have been marked as out of date.
+
+    Parameters
+    ----------
+    session : Session
+    force : bool, default: False
+        If True the rollups are recalculated even if they are up to date.
+    """
+
+    if not force and get_setting("rollups_stale", session, "0") != "1":
+        return
+
+    try:
+        for table, counts, sql in [("maps", ["games", "ct_wins", "t_wins"], MAP_ROLLUP_SQL),
+                                   ("agents", ["games", "wins"], AGENT_ROLLUP_SQL),
+                                   ("teams", ["games", "wins"], TEAM_ROLLUP_SQL),
+                                   ("comps", ["games", "wins"], COMP_ROLLUP_SQL)]:
+            if table == "comps" or get_setting("storage", session, "dense") == "sparse":
+                session.execute(text(f"DELETE FROM {table} "
+                                     "WHERE tournament = 'Overall' OR map = 'Overall'"))
+            else:
+                session.execute(text(f"UPDATE {table} SET " +
+                                     ", ".join([f"{count} = 0" for count in counts]) +
+                                     " WHERE tournament = 'Overall' OR map = 'Overall'"))
+            session.execute(text(sql))
+        set_setting("rollups_stale", "0", session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def set_rollups(mode: str, session: Session) -> None:
+    """
+    Changes how the "Overall" rows of the Map, Agent, Comp and Team tables are kept up to date and
+    rebuilds the tables.
+
+    Parameters
+    ----------
+    mode : {"stored", "read"}
+        "stored" updates every rollup as each match is added. "read" only updates the
+        (tournament, map) rows as matches are added and recalculates the rollups with
+        :func:`update_rollups` when the data is next viewed.
+    session : Session
+    """
+
+    if mode not in ["stored", "read"]:
+        raise ValueError(f"Unknown rollup mode: {mode}")
+    set_setting("rollups", mode, session)
+    rebuild(session)
+
+
+def set_keys(mode: str, session: Session) -> None:
+    """
+    Changes how the names of tournaments, maps, agents and teams are stored in the Match, Map,
+    Agent, Team and Comp tables. The tables are recreated with the new column types and their
+    names converted in a single transaction.
+
+    Parameters
+    ----------
+    mode : {"names", "ids"}
+        "names" stores the names as text. "ids" stores them as the integer id of the tournament or
+        referall, which the key columns translate to and from the names.
+    session : Session
+    """
+
+    if mode not in ["names", "ids"]:
+        raise ValueError(f"Unknown keys mode: {mode}")
+
+    try:
+        assign_ids(Tournament, session)
+        assign_ids(Referall, session)
+        set_setting("keys", mode, session)
+        session.flush()
+        if mode == "names":
+            encode_keys(session)
+        connection = session.connection()
+        for table in [Match.__table__, Map.__table__, Agent.__table__, Team.__table__,
+                      Comp.__table__]:
+            ddl = str(CreateTable(table).compile(connection)).replace(
+                f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_new ", 1)
+            if mode == "ids":
+                for column in table.columns:
+                    if isinstance(column.type, Key):
+                        ddl = ddl.replace(f"\t{column.name} VARCHAR", f"\t{column.name} INTEGER")
+                ddl = ddl.replace("REFERENCES tournaments (tournament)",
+                                  "REFERENCES tournaments (id)").replace(
+                    "REFERENCES referall (name)", "REFERENCES referall (id)")
+            columns = ", ".join([column.name for column in table.columns])
+            session.execute(text(ddl))
+            session.execute(text(f"INSERT INTO {table.name}_new ({columns}) "
+                                 f"SELECT {columns} FROM {table.name}"))
+            session.execute(text(f"DROP TABLE {table.name}"))
+            session.execute(text(f"ALTER TABLE {table.name}_new RENAME TO {table.name}"))
+            for index in table.indexes:
+                index.create(bind=connection)
+        if mode == "ids":
+            encode_keys(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
@@ -5,7 +5,7 @@ from sqlalchemy.orm import Session
 from collections import Counter
 
 from .databases import Tournament, Map, Agent, Comp, Team
-from .functions import choice_check, divide, int_input
+from .functions import choice_check, divide, int_input, fill_pool
 
 
 def view_maps(Tournaments: list[str], tournament_msg: str, Maps: list[str], map_msg: str,
@@ -40,6 +40,8 @@ def view_maps(Tournaments: list[str], tournament_msg: str, Maps: list[str], map_
                                              np.arange(1, len(Tournaments)+1)))
         maps = session.query(Map).where((Map.tournament == Tournaments[tournament_choice-1]) &
                                         (Map.map != "Overall")).order_by(Map.games.desc()).all()
+        maps = fill_pool(maps, Map, [Tournaments[tournament_choice-1]],
+                         [map for map in Maps if map != "Overall"], session)
         output = (f"Stats for {Tournaments[tournament_choice-1]}:\n" +
                   "Map{:7s}Picks{:>5s}Pickrate{:>2s}Sidedness\n".format("", "", ""))
         for map in maps:
@@ -99,9 +101,10 @@ def view_comps(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
                                       np.arange(1, len(Maps)+1)))
         map = session.query(Map).where((Map.tournament == Tournaments[tournament_choice-1]) &
                                        (Map.map == Maps[map_choice-1])).first()
+        games = map.games if map is not None else 0
         comps = session.query(Comp).where(
             (Comp.tournament == Tournaments[tournament_choice-1]) &
-            (Comp.map == Maps[map_choice-1])).order_by((Comp.wins/map.games).desc(),
+            (Comp.map == Maps[map_choice-1])).order_by((Comp.wins/games).desc(),
                                                        Comp.games.desc()).all()
 
         output = (f"Stats for {Maps[map_choice-1]} on {Tournaments[tournament_choice-1]}:\n" +
@@ -206,10 +209,13 @@ def view_agents(Tournaments: list[str], tournament_msg: str, Maps: list[str], ma
                                       np.arange(1, len(Maps)+1)))
         map = session.query(Map).where((Map.tournament == Tournaments[tournament_choice-1]) &
                                        (Map.map == Maps[map_choice-1])).first()
+        games = map.games if map is not None else 0
         agents = session.query(Agent).where(
             (Agent.tournament == Tournaments[tournament_choice-1]) &
-            (Agent.map == Maps[map_choice-1])).order_by((Agent.wins/map.games).desc(),
+            (Agent.map == Maps[map_choice-1])).order_by((Agent.wins/games).desc(),
                                                         Agent.games.desc()).all()
+        agents = fill_pool(agents, Agent, [Tournaments[tournament_choice-1]],
+                           [Maps[map_choice-1]], session)
         output = (f"Stats for {Maps[map_choice-1]} on {Tournaments[tournament_choice-1]}:\n" +
                   "Agent{:7s}Pickrate{:3s}Winrate{:4s}Rating\n".format("", "", ""))
         for agent in agents:
@@ -230,6 +236,9 @@ def view_agents(Tournaments: list[str], tournament_msg: str, Maps: list[str], ma
             (Agent.map != "Overall") &
             (Agent.agent == Agents[agent_choice-1])).order_by((Agent.wins/Agent.games).desc(),
                                                               Agent.games.desc()).all()
+        agents = fill_pool(agents, Agent, [Tournaments[tournament_choice-1]],
+                           [map for map in Maps if map != "Overall"], session,
+                           [Agents[agent_choice-1]])
         output = (f"Stats for {Agents[agent_choice-1]} on {Tournaments[tournament_choice-1]}:\n" +
                   "Map{:7s}Pickrate{:<2s}Winrate{:<3s}Rating\n".format("", "", ""))
         for agent in agents:
@@ -248,6 +257,9 @@ def view_agents(Tournaments: list[str], tournament_msg: str, Maps: list[str], ma
             (Agent.tournament != "Overall") &
             (Agent.map == Maps[map_choice-1]) &
             (Agent.agent == Agents[agent_choice-1])).all()
+        agents = fill_pool(agents, Agent,
+                           [tournament for tournament in Tournaments if tournament != "Overall"],
+                           [Maps[map_choice-1]], session, [Agents[agent_choice-1]])
         output = (f"Stats for {Agents[agent_choice-1]} on {Maps[map_choice-1]}:\n" +
                   "Tournament{:10s}Pickrate{:<2s}Winrate{:<3s}Rating\n".format("", "", ""))
         for agent in agents:
@@ -298,10 +310,13 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
         map = session.query(Map).where(
             (Map.tournament == Tournaments[tournament_choice-1]) &
             (Map.map == Maps[map_choice-1])).first()
+        games = map.games if map is not None else 0
         teams = session.query(Team).where(
             (Team.tournament == (Tournaments[tournament_choice-1])) &
-            (Team.map == Maps[map_choice-1])).order_by((Team.wins/map.games).desc(),
+            (Team.map == Maps[map_choice-1])).order_by((Team.wins/games).desc(),
                                                        Team.games.desc()).all()
+        teams = fill_pool(teams, Team, [Tournaments[tournament_choice-1]],
+                          [Maps[map_choice-1]], session)
         output = (f"Stats for {Maps[map_choice-1]} on {Tournaments[tournament_choice-1]}:\n" +
                   "Team{:14s}Matches{:2s}Pickrate{:3s}Winrate{:4s}Rating\n".format("", "", "", ""))
         for team in teams:
@@ -309,6 +324,8 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
                 (Team.tournament == Tournaments[tournament_choice-1]) &
                 (Team.map == "Overall") &
                 (Team.team == team.team)).first()
+            if team_ovr is None:
+                team_ovr = team
             pickrate = divide(team.games, team_ovr.games)
             winrate = divide(team.wins, team.games)
             rating = pickrate * winrate * 100
@@ -325,7 +342,10 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
             (Team.tournament == Tournaments[tournament_choice-1]) &
             (Team.map != "Overall") &
             (Team.team == Teams[team_choice-1])).order_by((Team.wins/Team.games).desc(),
-                                                          Team.games().desc()).all()
+                                                          Team.games.desc()).all()
+        teams = fill_pool(teams, Team, [Tournaments[tournament_choice-1]],
+                          [map for map in Maps if map != "Overall"], session,
+                          [Teams[team_choice-1]])
         output = (f"Stats for {Teams[team_choice-1]} on {Tournaments[tournament_choice-1]}:\n" +
                   "Map{:7s}Pickrate{:<2s}Winrate{:<3s}Rating\n".format("", "", ""))
         for team in teams:
@@ -333,6 +353,8 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
                 (Team.tournament == Tournaments[tournament_choice-1]) &
                 (Team.map == "Overall") &
                 (Team.team == Teams[team_choice-1])).first()
+            if team_ovr is None:
+                team_ovr = team
             pickrate = divide(team.games, team_ovr.games)
             winrate = divide(team.wins, team.games)
             rating = pickrate * winrate * 100
@@ -348,6 +370,9 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
             (Team.tournament != "Overall") &
             (Team.map == Maps[map_choice-1]) &
             (Team.team == Teams[team_choice-1])).all()
+        teams = fill_pool(teams, Team,
+                          [tournament for tournament in Tournaments if tournament != "Overall"],
+                          [Maps[map_choice-1]], session, [Teams[team_choice-1]])
         output = (f"Stats for {Teams[team_choice-1]} on {Maps[map_choice-1]}:\n" +
                   "Tournament{:10s}Pickrate{:<2s}Winrate{:<3s}Rating\n".format("", "", ""))
         for team in teams:
@@ -355,6 +380,8 @@ def view_teams(Tournaments: list[str], tournament_msg: str, Maps: list[str], map
                 (Team.tournament == team.tournament) &
                 (Team.map == "Overall") &
                 (Team.team == Teams[team_choice-1])).first()
+            if team_ovr is None:
+                team_ovr = team
             pickrate = divide(team.games, team_ovr.games)
             winrate = divide(team.wins, team.games)
             rating = pickrate * winrate * 100
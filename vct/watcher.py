@@ -0,0 +1,154 @@
+import datetime
+import threading
+from typing import Any, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .cache import ResponseCache
+from .databases import WatchedEvent
+from .get_data import LIVE, VLRScrape, parse_match_schedule
+
+
+def poll_interval(schedule: list[dict[str, Any]], live: datetime.timedelta,
+                  idle: datetime.timedelta) -> Optional[datetime.timedelta]:
+    """
+    Finds how long to wait before polling an event again.
+
+    Parameters
+    ----------
+    schedule : list[dict[str, Any]]
+        The event's matches, from :func:`~get_data.parse_match_schedule`.
+    live : datetime.timedelta
+        The interval while a match is being played, which is also the shortest interval.
+    idle : datetime.timedelta
+        The longest interval, used when it is not known when the next match starts.
+
+    Returns
+    -------
+    Optional[datetime.timedelta]
+        The interval, or None if every match has been completed.
+    """
+
+    remaining = [match for match in schedule
+                 if match["status"] != "completed" and not match["showmatch"]]
+    if schedule and not remaining:
+        return None
+    if any([match["status"] == "live" for match in remaining]):
+        return live
+    etas = [match["eta"] for match in remaining if match["eta"] is not None]
+    if etas:
+        return min(max(datetime.timedelta(seconds=min(etas)), live), idle)
+    return idle
+
+
+class EventWatcher:
+    live_interval = datetime.timedelta(minutes=5)
+    idle_interval = datetime.timedelta(hours=6)
+    check_interval = 60
+
+    def __init__(self, session: Session, scraper: Optional[VLRScrape] = None):
+        """
+        Long running watcher keeping the events in the watched_events table up to date. Each
+        event's matches page is polled with a conditional request, and any match that has been
+        completed since the last poll is scraped straight away with the ``LIVE`` priority, ahead
+        of other jobs. Completed matches which were already waiting as jobs are moved up to
+        ``LIVE``, and ``LIVE`` jobs which failed are retried at each poll. Events are polled every
+        ``live_interval`` while a match is being played, otherwise when the next match is due to
+        start, up to ``idle_interval``, and are no longer polled once every match is completed.
+        Requests wait on the scraper's rate limiter, which by default is shared with every other
+        scraper in the process.
+
+        Parameters
+        ----------
+        session : Session
+        scraper : Optional[VLRScrape], default: None
+            The scraper used to fetch pages and add matches. By default one whose cached matches
+            pages are always requested again.
+        """
+
+        self.session = session
+        if scraper is None:
+            scraper = VLRScrape(session, cache=ResponseCache(
+                ttls={"event": datetime.timedelta(0)}))
+        scraper.session = session
+        self.scraper = scraper
+
+    def watch(self, url: str) -> None:
+        """Starts watching an event, polling it straight away."""
+        now = datetime.datetime.now()
+        stmt = insert(WatchedEvent)
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=["url"], set_=dict(next_poll=now, finished=False)),
+            dict(url=url, next_poll=now, finished=False))
+        self.session.commit()
+
+    def unwatch(self, url: str) -> None:
+        self.session.execute(delete(WatchedEvent).where(WatchedEvent.url == url))
+        self.session.commit()
+
+    def poll(self, url: str) -> Optional[datetime.datetime]:
+        """
+        Checks an event for newly completed matches and scrapes them.
+
+        Parameters
+        ----------
+        url : str
+            The event's url.
+
+        Returns
+        -------
+        Optional[datetime.datetime]
+            When the event is next polled, or None if it is finished.
+        """
+
+        try:
+            schedule = parse_match_schedule(self.scraper.fetch(self.scraper.matches_url(url)))
+        except Exception as error:
+            print(f"Failed: {url}\n{type(error).__name__}: {error}")
+            interval = self.live_interval
+        else:
+            self.scraper.add_jobs("event", [url], LIVE)
+            self.scraper.store_match_list(
+                url, [match["href"] for match in schedule
+                      if match["status"] == "completed" and not match["showmatch"]], LIVE)
+            if self.scraper.next_job("match", set(), LIVE) is not None:
+                self.scraper.find_match_data(LIVE)
+            interval = poll_interval(schedule, self.live_interval, self.idle_interval)
+
+        now = datetime.datetime.now()
+        next_poll = now + interval if interval is not None else None
+        event = self.session.get(WatchedEvent, url)
+        if event is not None:
+            event.last_polled = now
+            event.next_poll = next_poll or now
+            event.finished = next_poll is None
+        self.session.commit()
+        if next_poll is None:
+            print(f"Finished watching: {url}")
+        return next_poll
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        """
+        Polls each watched event when it is due until every event is finished.
+
+        Parameters
+        ----------
+        stop : Optional[threading.Event], default: None
+            Stops the watcher when set, such as from another thread.
+        """
+
+        if stop is None:
+            stop = threading.Event()
+        while not stop.is_set():
+            event = self.session.scalars(select(WatchedEvent).where(
+                WatchedEvent.finished.is_(False)).order_by(WatchedEvent.next_poll)).first()
+            if event is None:
+                print("No events are being watched.")
+                return
+            wait = (event.next_poll - datetime.datetime.now()).total_seconds()
+            if wait > 0:
+                stop.wait(min(wait, self.check_interval))
+            else:
+                self.poll(event.url)